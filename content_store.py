@@ -0,0 +1,95 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import zipfile
+from typing import Optional
+
+class ContentStore:
+    """Store extracted archive members once by SHA-256 and link them into release folders.
+
+    Objects live under objects/<sha[:2]>/<sha[2:]> and are made read-only,
+    since every release folder holding a member shares the same inode. The
+    index maps a member's CRC-32, size and compressed size to the object
+    that holds it, one small file per key so that concurrent extractions,
+    in processes or threads, never contend on a shared file; a member seen
+    in an earlier release is then linked without being inflated again.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.objects_dir = os.path.join(root, 'objects')
+        self.index_dir = os.path.join(root, 'index')
+        self.tmp_dir = os.path.join(root, 'tmp')
+        for path in (self.objects_dir, self.index_dir, self.tmp_dir):
+            os.makedirs(path, exist_ok=True)
+
+    def object_path(self, sha256: str) -> str:
+        return os.path.join(self.objects_dir, sha256[:2], sha256[2:])
+
+    def member_key(self, info: zipfile.ZipInfo) -> str:
+        return f"{info.CRC:08x}-{info.file_size}-{info.compress_size}"
+
+    def lookup(self, info: zipfile.ZipInfo) -> Optional[str]:
+        """Return the SHA-256 of a stored object holding this member, if any."""
+        try:
+            with open(os.path.join(self.index_dir, self.member_key(info))) as f:
+                sha256 = f.read().strip()
+        except FileNotFoundError:
+            return None
+        return sha256 if os.path.exists(self.object_path(sha256)) else None
+
+    def add(self, zip_ref: zipfile.ZipFile, info: zipfile.ZipInfo) -> str:
+        """Inflate a member into the store, returning its SHA-256."""
+        sha256 = hashlib.sha256()
+        with zip_ref.open(info) as source, \
+                tempfile.NamedTemporaryFile(dir=self.tmp_dir, delete=False) as target:
+            for block in iter(lambda: source.read(1024 * 1024), b''):
+                sha256.update(block)
+                target.write(block)
+        digest = sha256.hexdigest()
+
+        object_path = self.object_path(digest)
+        if os.path.exists(object_path):
+            os.remove(target.name)
+        else:
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            os.chmod(target.name, 0o444)
+            os.replace(target.name, object_path)
+
+        with tempfile.NamedTemporaryFile('w', dir=self.tmp_dir, delete=False) as f:
+            f.write(digest)
+        os.replace(f.name, os.path.join(self.index_dir, self.member_key(info)))
+        return digest
+
+    def link(self, sha256: str, target: str):
+        """Put a stored object at target as a hardlink, or a copy where links are unsupported."""
+        object_path = self.object_path(sha256)
+        if os.path.exists(target) and os.path.samefile(object_path, target):
+            return
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        link_tmp = target + '.link'
+        if os.path.lexists(link_tmp):
+            os.remove(link_tmp)
+        try:
+            os.link(object_path, link_tmp)
+        except OSError:
+            # Other filesystem than the store, or no hardlink support
+            shutil.copyfile(object_path, link_tmp)
+        os.replace(link_tmp, target)
+
+    def extract(self, zip_ref: zipfile.ZipFile, info: zipfile.ZipInfo, extract_dir: str) -> Optional[str]:
+        """Extract one member through the store, returning its SHA-256 (None for folders)."""
+        parts = info.filename.split('/')
+        if info.filename.startswith('/') or '..' in parts or '\\' in info.filename or ':' in parts[0]:
+            raise Exception(f"{info.filename} is not a safe member path")
+
+        target = os.path.join(extract_dir, *filter(None, parts))
+        if info.is_dir():
+            os.makedirs(target, exist_ok=True)
+            return None
+
+        sha256 = self.lookup(info) or self.add(zip_ref, info)
+        self.link(sha256, target)
+        return sha256
@@ -0,0 +1,107 @@
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Type
+
+from dmd_parser import FLOAT_FIELDS, INT_FIELDS, Record, available_types, iter_records, table_name
+from dmd_parser import release_name as source_name
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # Optional: only needed when exporting releases
+    pa = None
+    pq = None
+
+FORMATS = {'arrow': '.arrow', 'parquet': '.parquet'}
+
+
+def arrow_type(field: str) -> 'pa.DataType':
+    if field in INT_FIELDS:
+        return pa.int64()
+    if field in FLOAT_FIELDS:
+        return pa.float64()
+    return pa.dictionary(pa.int32(), pa.string())
+
+
+def read_table(path: str, columns: Optional[List[str]] = None) -> 'pa.Table':
+    """Read an exported table, memory-mapped and limited to the given columns."""
+    if path.endswith(FORMATS['parquet']):
+        return pq.read_table(path, columns=columns, memory_map=True)
+    # Arrow files are written uncompressed, so columns are used straight from the mapping
+    table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    return table.select(columns) if columns else table
+
+
+class ArrowExporter:
+    """Export dm+d releases to one columnar file per record type.
+
+    Files are written to <export_dir>/<release>/<table>.arrow (Arrow IPC,
+    uncompressed so readers can memory-map them) or .parquet. Text columns
+    are dictionary encoded, which suits the many repeated codes and dates of
+    a release; IDs and flags are int64 and quantities float64. A marker
+    written after the last table records the row counts, so a release
+    already exported in the format is not exported again.
+    """
+
+    def __init__(self, export_dir: str, file_format: str = 'arrow'):
+        if pa is None:
+            raise ImportError("Exporting releases needs pyarrow (pip install pyarrow)")
+        if file_format not in FORMATS:
+            raise ValueError(f"Unknown export format {file_format!r}, expected one of {', '.join(FORMATS)}")
+        self.export_dir = export_dir
+        self.file_format = file_format
+
+    def schema(self, record_type: Type[Record]) -> 'pa.Schema':
+        return pa.schema([pa.field(field, arrow_type(field)) for field in record_type.__slots__])
+
+    def build_table(self, record_type: Type[Record], records) -> 'pa.Table':
+        columns = [[] for _ in record_type.__slots__]
+        for record in records:
+            for column, value in zip(columns, record.astuple()):
+                column.append(value)
+
+        arrays = []
+        for field, values in zip(record_type.__slots__, columns):
+            if field in INT_FIELDS or field in FLOAT_FIELDS:
+                arrays.append(pa.array(values, type=arrow_type(field)))
+            else:
+                arrays.append(pa.array(values, type=pa.string()).dictionary_encode())
+        return pa.Table.from_arrays(arrays, schema=self.schema(record_type))
+
+    def write_table(self, table: 'pa.Table', path: str):
+        tmp_path = path + '.tmp'
+        if self.file_format == 'parquet':
+            pq.write_table(table, tmp_path)
+        else:
+            with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
+
+    def export(self, source: str, release_name: Optional[str] = None) -> Dict[str, int]:
+        """Export a release folder or zip, returning the row count of each table."""
+        release_dir = os.path.join(self.export_dir, release_name or source_name(source))
+        marker_path = os.path.join(release_dir, 'export' + FORMATS[self.file_format] + '.json')
+        if os.path.exists(marker_path):
+            logging.info(f"{release_dir} is already exported. Skipping.")
+            with open(marker_path) as f:
+                return json.load(f)
+
+        os.makedirs(release_dir, exist_ok=True)
+        counts = {}
+        start = time.monotonic()
+
+        for record_type in available_types(source):
+            table = self.build_table(record_type, iter_records(source, record_type))
+            self.write_table(table, os.path.join(release_dir, table_name(record_type) + FORMATS[self.file_format]))
+            counts[table_name(record_type)] = table.num_rows
+
+        with open(marker_path + '.tmp', 'w') as f:
+            json.dump(counts, f)
+        os.replace(marker_path + '.tmp', marker_path)
+
+        logging.info(f"Exported {sum(counts.values())} rows of {len(counts)} tables to {release_dir} "
+                     f"in {time.monotonic() - start:.2f}s")
+        return counts
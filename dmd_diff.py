@@ -0,0 +1,162 @@
+import os
+import sys
+import json
+import argparse
+import logging
+from typing import Dict, Iterator, List, Optional, Type
+from dmd_parser import RECORD_TYPES, Record, available_types, iter_records, table_name
+
+ADDED = 'added'
+REMOVED = 'removed'
+CHANGED = 'changed'
+INVALIDATED = 'invalidated'
+KINDS = (ADDED, REMOVED, CHANGED, INVALIDATED)
+
+_MISSING = object()
+
+
+class Change:
+    """One record added, removed or changed between two releases."""
+    __slots__ = ('kind', 'record_type', 'key', 'old', 'new')
+
+    def __init__(self, kind: str, record_type: Type[Record], key, old: Optional[Record] = None,
+                 new: Optional[Record] = None):
+        self.kind = kind
+        self.record_type = record_type
+        self.key = key
+        self.old = old
+        self.new = new
+
+    def fields(self) -> List[str]:
+        """Names of the fields that differ between the old and new record."""
+        if self.old is None or self.new is None:
+            return []
+        return [field for field in self.record_type.__slots__
+                if getattr(self.old, field) != getattr(self.new, field)]
+
+    def asdict(self) -> Dict:
+        return {
+            'kind': self.kind,
+            'table': table_name(self.record_type),
+            'key': self.key,
+            'fields': self.fields(),
+            'old': self.old.asdict() if self.old is not None else None,
+            'new': self.new.asdict() if self.new is not None else None
+        }
+
+
+def records_or_empty(source: str, record_type: Type[Record]) -> Iterator[Record]:
+    """Records of a type, or none when the release has no file for it."""
+    try:
+        yield from iter_records(source, record_type)
+    except FileNotFoundError:
+        return
+
+
+def diff_records(old_source: str, new_source: str, record_type: Type[Record],
+                 resolve_old: bool = True) -> Iterator[Change]:
+    """Stream the changes of one record type between two releases (folders or zips).
+
+    The old release is reduced to one fingerprint (the record hash) per ID,
+    the new release is streamed against it, and only for the IDs found to
+    differ is the old release read again to recover the old records. Time
+    is linear in the size of both releases; memory is one fingerprint per
+    record plus the changed records.
+
+    Without resolve_old the second read is skipped: changes carry only the
+    new record (and are never reported as invalidated), removals only the key.
+    """
+    fingerprints = {record.id: hash(record) for record in records_or_empty(old_source, record_type)}
+    changed = {}
+
+    for record in records_or_empty(new_source, record_type):
+        fingerprint = fingerprints.pop(record.id, _MISSING)
+        if fingerprint is _MISSING:
+            yield Change(ADDED, record_type, record.id, new=record)
+        elif fingerprint != hash(record):
+            if resolve_old:
+                changed[record.id] = record
+            else:
+                yield Change(CHANGED, record_type, record.id, new=record)
+
+    # What is left of the fingerprints was removed in the new release
+    if not resolve_old:
+        for key in fingerprints:
+            yield Change(REMOVED, record_type, key)
+        return
+    if not (changed or fingerprints):
+        return
+    for record in records_or_empty(old_source, record_type):
+        if record.id in changed:
+            new = changed.pop(record.id)
+            if record == new:
+                continue
+            invalidated = 'invalid' in record_type.__slots__ and not record.invalid and new.invalid
+            yield Change(INVALIDATED if invalidated else CHANGED, record_type, record.id, record, new)
+        elif fingerprints.pop(record.id, _MISSING) is not _MISSING:
+            yield Change(REMOVED, record_type, record.id, old=record)
+
+
+def diff_releases(old_source: str, new_source: str,
+                  record_types: Optional[List[Type[Record]]] = None) -> Iterator[Change]:
+    """Stream the changes of every record type found in either release."""
+    if record_types is None:
+        present = set(available_types(old_source)) | set(available_types(new_source))
+        record_types = [record_type for record_type in RECORD_TYPES if record_type in present]
+    for record_type in record_types:
+        yield from diff_records(old_source, new_source, record_type)
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compare two DM+D releases.")
+    parser.add_argument('old', help="folder or zip of the older release")
+    parser.add_argument('new', help="folder or zip of the newer release")
+    parser.add_argument('--types',
+                        help="comma separated record types to compare, e.g. vmp,amp (default: all)")
+    parser.add_argument('--output', metavar='FILE',
+                        help="write every change to FILE as JSON lines ('-' for stdout)")
+    return parser.parse_args(argv)
+
+
+def main(argv: list = None):
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    args = parse_args(argv)
+
+    for source in (args.old, args.new):
+        if not os.path.exists(source):
+            logging.error(f"Error: {source} does not exist")
+            sys.exit(1)
+
+    record_types = None
+    if args.types:
+        by_name = {table_name(record_type): record_type for record_type in RECORD_TYPES}
+        names = [name.strip().lower() for name in args.types.split(',')]
+        unknown = [name for name in names if name not in by_name]
+        if unknown:
+            logging.error(f"Error: unknown record types {', '.join(unknown)}")
+            sys.exit(1)
+        record_types = [by_name[name] for name in names]
+
+    output = None
+    if args.output:
+        output = sys.stdout if args.output == '-' else open(args.output, 'w')
+
+    counts = {}
+    try:
+        for change in diff_releases(args.old, args.new, record_types):
+            table = table_name(change.record_type)
+            counts.setdefault(table, dict.fromkeys(KINDS, 0))[change.kind] += 1
+            if output is not None:
+                output.write(json.dumps(change.asdict()) + '\n')
+    finally:
+        if output is not None and output is not sys.stdout:
+            output.close()
+
+    if not counts:
+        logging.info("No differences")
+    for table, kinds in counts.items():
+        logging.info(f"{table}: " + ', '.join(f"{count} {kind}" for kind, count in kinds.items()))
+
+
+if __name__ == "__main__":
+    main()
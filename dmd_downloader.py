@@ -1,236 +1,144 @@
-import requests
 import os
 import sys
-from typing import Optional, List, Dict
-import json
-from dotenv import load_dotenv
-from datetime import datetime
+import re
+import argparse
+import asyncio
 import logging
-import pytz 
-import zipfile
-
-class TRUDApiClient:
-    def __init__(self, api_key: str):
-        self.api_key = api_key.lower()
-        self.base_url = "https://isd.digital.nhs.uk/trud/api/v1"
-        self.headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-            'Accept': 'application/json'
-        }
-        self.timezone = pytz.timezone('Asia/Dhaka')
-        self.setup_logging()
-    
-    def setup_logging(self):
-        """Setup logging configuration"""
-        log_dir = 'logs'
-        os.makedirs(log_dir, exist_ok=True)
-        
-        timestamp = datetime.now(self.timezone).strftime('%Y%m%d')
-        log_file = os.path.join(log_dir, f'dmd_downloader_{timestamp}.log')
-        
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - Bangladesh Time - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(log_file),
-                logging.StreamHandler()
-            ]
-        )
-        
-        bd_time = datetime.now(self.timezone).strftime('%Y-%m-%d %H:%M:%S %Z')
-        logging.info(f"Script started at {bd_time}")
-
-    def extract_zip(self, zip_path: str) -> bool:
-        """Extract zip file to a folder named after the zip file."""
-        try:
-            # Create extraction directory name from zip file
-            zip_name = os.path.splitext(os.path.basename(zip_path))[0]
-            extract_dir = os.path.join('extracted', zip_name)
-            
-            # Create extraction directory
-            os.makedirs(extract_dir, exist_ok=True)
-            
-            logging.info(f"Extracting {zip_path} to {extract_dir}")
-            
-            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                zip_ref.extractall(extract_dir)
-            
-            completion_time = datetime.now(self.timezone).strftime('%Y-%m-%d %H:%M:%S %Z')
-            logging.info(f"Successfully extracted {zip_path} at {completion_time}")
-            return True
-            
-        except Exception as e:
-            logging.error(f"Error extracting {zip_path}: {str(e)}")
-            return False
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+import pytz
+from trud_client import AsyncTRUDApiClient, BackfillScheduler
 
-    def get_releases(self, item_id: str, latest_only: bool = True) -> List[Dict]:
-        """Get releases for an item."""
-        try:
-            url = f"{self.base_url}/keys/{self.api_key}/items/{item_id}/releases"
-            if latest_only:
-                url += "?latest"
-            
-            logging.info(f"Fetching releases from API")
-            response = requests.get(url)
-            response.raise_for_status()
-            
-            data = response.json()
-            if data.get('message') != 'OK':
-                raise Exception(f"API Error: {data.get('message', 'Unknown error')}")
-            
-            return data.get('releases', [])
-        
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Error fetching releases: {str(e)}")
-            if hasattr(e, 'response'):
-                logging.error(f"Response status: {e.response.status_code}")
-                logging.error(f"Response body: {e.response.text}")
-            return []
+def parse_since(value: str) -> timedelta:
+    """Parse a --since window such as 30d, 4w or a plain number of days."""
+    match = re.fullmatch(r'(\d+)([dw]?)', value.strip().lower())
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid window {value!r}, expected e.g. 30d or 4w")
+    return timedelta(days=int(match.group(1)) * (7 if match.group(2) == 'w' else 1))
 
-    def is_new_release(self, filename: str, file_url: str) -> bool:
-        """Check if this is a new release that needs to be downloaded."""
-        downloads_dir = 'downloads'
-        existing_file = os.path.join(downloads_dir, filename)
-        
-        if not os.path.exists(existing_file):
-            return True
-            
-        try:
-            response = requests.head(file_url)
-            remote_size = int(response.headers.get('content-length', 0))
-            local_size = os.path.getsize(existing_file)
-            
-            if remote_size != local_size:
-                return True
-                
-            if 'last-modified' in response.headers:
-                remote_date = datetime.strptime(
-                    response.headers['last-modified'], 
-                    '%a, %d %b %Y %H:%M:%S %Z'
-                ).replace(tzinfo=pytz.UTC)
-                local_date = datetime.fromtimestamp(
-                    os.path.getmtime(existing_file)
-                ).astimezone(pytz.UTC)
-                if remote_date > local_date:
-                    return True
-            
-            return False
-            
-        except Exception as e:
-            logging.warning(f"Error checking file status: {str(e)}")
-            return True
+def parse_args(argv: list = None) -> argparse.Namespace:
+    """Parse the command line; defaults come from the environment (.env) where set."""
+    parser = argparse.ArgumentParser(description="Download and extract DM+D releases from NHS TRUD.")
 
-    def download_file(self, url: str, filename: str) -> bool:
-        """Download a file with progress indicator."""
-        try:
-            if not self.is_new_release(filename, url):
-                logging.info(f"File {filename} is already up to date. Skipping download.")
-                return True
-            
-            downloads_dir = 'downloads'
-            os.makedirs(downloads_dir, exist_ok=True)
-            filepath = os.path.join(downloads_dir, filename)
-            
-            logging.info(f"Starting download: {filename}")
-            response = requests.get(url, stream=True)
-            response.raise_for_status()
-            
-            total_size = int(response.headers.get('content-length', 0))
-            block_size = 1024  # chunk size for optimization
-            downloaded = 0
-            
-            with open(filepath, 'wb') as f:
-                for data in response.iter_content(block_size):
-                    downloaded += len(data)
-                    f.write(data)
-                    if total_size:
-                        percent = int(100 * downloaded / total_size)
-                        sys.stdout.write(f"\rProgress: {percent}%")
-                        sys.stdout.flush()
-            
-            completion_time = datetime.now(self.timezone).strftime('%Y-%m-%d %H:%M:%S %Z')
-            logging.info(f"Successfully downloaded {filepath} at {completion_time}")
-            return True
-            
-        except Exception as e:
-            logging.error(f"Error downloading {filename}: {str(e)}")
-            return False
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--latest', action='store_true',
+                      help="download the latest release of each item (default)")
+    mode.add_argument('--since', type=parse_since, metavar='WINDOW',
+                      help="backfill every release from the last WINDOW, e.g. 30d or 4w")
 
-    def download_release(self, release: Dict, 
-                        include_checksum: bool = False,
-                        include_signature: bool = False,
-                        extract_after_download: bool = True) -> bool:
-        """Download a specific release and its associated files."""
-        success = True
-        
-        if 'archiveFileUrl' in release:
-            file_success = self.download_file(
-                release['archiveFileUrl'],
-                release['archiveFileName']
-            )
-            success &= file_success
-            
-            if file_success and extract_after_download:
-                zip_path = os.path.join('downloads', release['archiveFileName'])
-                success &= self.extract_zip(zip_path)
-        
-        if include_checksum and 'checksumFileUrl' in release:
-            success &= self.download_file(
-                release['checksumFileUrl'],
-                release['checksumFileName']
-            )
-        
-        if include_signature and 'signatureFileUrl' in release:
-            success &= self.download_file(
-                release['signatureFileUrl'],
-                release['signatureFileName']
-            )
-        
-        return success
+    # Item IDs depend on our subscription, e.g. 24 (dm+d) or 14, 25 (dm+d bonus)
+    parser.add_argument('--items', default=os.getenv('TRUD_ITEM_IDS', '24'),
+                        help="comma separated TRUD item IDs (default: %(default)s)")
+    parser.add_argument('--concurrency', type=int, default=int(os.getenv('TRUD_DOWNLOAD_CONCURRENCY', '4')),
+                        help="releases downloaded at the same time (default: %(default)s)")
+    parser.add_argument('--segments', type=int, default=int(os.getenv('TRUD_DOWNLOAD_SEGMENTS', '1')),
+                        help="concurrent byte ranges used for each download (default: %(default)s)")
+    parser.add_argument('--extract', action=argparse.BooleanOptionalAction,
+                        help="extract the archives after downloading (default: only when nothing reads the "
+                             "releases, as --database, --export and --snapshot read them straight from the zip)")
+    parser.add_argument('--stream-extract', action='store_true',
+                        default=os.getenv('TRUD_STREAM_EXTRACT', '0') == '1',
+                        help="extract archive members while they download instead of afterwards")
+    parser.add_argument('--extract-workers', type=int, default=int(os.getenv('TRUD_EXTRACT_WORKERS', '1')),
+                        help="processes extracting archive members in parallel (default: %(default)s)")
+    parser.add_argument('--nested-depth', type=int, default=int(os.getenv('TRUD_NESTED_DEPTH', '1')),
+                        metavar='N',
+                        help="levels of zips inside an archive (e.g. the GTIN zip) extracted along with it, "
+                             "0 to leave them zipped (default: %(default)s)")
+    parser.add_argument('--content-store', default=os.getenv('TRUD_CONTENT_STORE'), metavar='DIR',
+                        help="store extracted members once by hash in DIR and hardlink them into each release")
+    parser.add_argument('--database', default=os.getenv('TRUD_DATABASE'), metavar='PATH',
+                        help="load each release into the SQLite database at PATH")
+    parser.add_argument('--incremental', action='store_true',
+                        default=os.getenv('TRUD_DATABASE_INCREMENTAL', '0') == '1',
+                        help="update the database with only the changes since the release it was last loaded from")
+    parser.add_argument('--export', default=os.getenv('TRUD_EXPORT_DIR'), metavar='DIR',
+                        help="export each release to columnar files under DIR (needs pyarrow)")
+    parser.add_argument('--export-format', choices=['arrow', 'parquet'],
+                        default=os.getenv('TRUD_EXPORT_FORMAT', 'arrow'),
+                        help="file format of the exports (default: %(default)s)")
+    parser.add_argument('--snapshot', default=os.getenv('TRUD_SNAPSHOT_DIR'), metavar='DIR',
+                        help="write each release to a memory-mappable snapshot file under DIR")
+    parser.add_argument('--no-checksum', action='store_true',
+                        help="skip downloading and verifying the checksum files")
+    parser.add_argument('--releases-ttl', type=int, default=int(os.getenv('TRUD_RELEASES_TTL', '3600')),
+                        help="seconds a cached releases listing is used without asking the API (default: %(default)s)")
+    parser.add_argument('--offline', action='store_true', default=os.getenv('TRUD_OFFLINE', '0') == '1',
+                        help="answer from the cached releases listing without any API request")
+    args = parser.parse_args(argv)
+    if args.database and args.since is not None:
+        # Backfilled releases finish in any order, so the database would end up on a random one
+        parser.error("--database only applies to --latest")
+    if args.stream_extract and args.content_store:
+        # Members extracted while downloading are written as plain files, bypassing the store
+        parser.error("--stream-extract cannot be combined with --content-store")
+    if args.extract is None:
+        args.extract = not (args.database or args.export or args.snapshot)
+    return args
 
-def main():
+def main(argv: list = None):
     load_dotenv()
-    
+    args = parse_args(argv)
+
     api_key = os.getenv('TRUD_API_KEY')
     if not api_key:
         logging.error("Error: TRUD_API_KEY not found in .env file")
         sys.exit(1)
-    
-    item_id = "24"  # here we can use our item count based on subscription we can keep it 24 or 14 
-    
+
+    item_ids = [item_id.strip() for item_id in args.items.split(',')]
+    options = {
+        'include_checksum': not args.no_checksum,
+        'include_signature': False,
+        'extract_after_download': args.extract
+    }
+
     try:
-        client = TRUDApiClient(api_key)
-        
-        logging.info(f"Fetching dm+d releases (item ID: {item_id})...")
-        releases = client.get_releases(item_id, latest_only=True)
-        
-        if not releases:
-            logging.warning("No releases found")
-            sys.exit(1)
-        
-        for release in releases:
-            logging.info("\nRelease Information:")
-            logging.info(f"Release ID: {release.get('releaseId', 'N/A')}")
-            logging.info(f"Release Date: {release.get('releaseDate', 'N/A')}")
-            logging.info(f"File Name: {release.get('archiveFileName', 'N/A')}")
-            
-            success = client.download_release(
-                release,
-                include_checksum=True,
-                include_signature=False,
-                extract_after_download=True
-            )
-            
-            if not success:
-                logging.error("Failed to download or extract some files")
-                sys.exit(1)
-        
+        with AsyncTRUDApiClient(api_key, concurrency=args.concurrency,
+                                download_segments=args.segments,
+                                stream_extract=args.stream_extract,
+                                extract_workers=args.extract_workers,
+                                nested_depth=args.nested_depth,
+                                releases_ttl=args.releases_ttl,
+                                offline=args.offline,
+                                content_store=args.content_store,
+                                database=args.database,
+                                incremental_load=args.incremental,
+                                export_dir=args.export,
+                                export_format=args.export_format,
+                                snapshot_dir=args.snapshot) as client:
+            if args.since is None:
+                success = asyncio.run(client.refresh_items(item_ids, latest_only=True, **options))
+
+                if not success:
+                    logging.error("Failed to download or extract some files")
+                    sys.exit(1)
+            else:
+                logging.info(f"Fetching releases from last {args.since.days} days (item IDs: {', '.join(item_ids)})...")
+                releases_by_item = asyncio.run(
+                    client.get_releases_for_items(item_ids, latest_only=False, since=args.since)
+                )
+                releases = [release for item_releases in releases_by_item.values() for release in item_releases]
+
+                if not releases:
+                    logging.warning(f"No releases found in the last {args.since.days} days")
+                    sys.exit(1)
+
+                for release in releases:
+                    logging.info("\nRelease Information:")
+                    logging.info(f"Release ID: {release.get('releaseId', 'N/A')}")
+                    logging.info(f"Release Date: {release.get('releaseDate', 'N/A')}")
+                    logging.info(f"File Name: {release.get('archiveFileName', 'N/A')}")
+
+                # Failed releases are logged and the rest carry on instead of exiting
+                scheduler = BackfillScheduler(client.client, concurrency=args.concurrency)
+                scheduler.run(scheduler.plan(releases, include_checksum=options['include_checksum']), **options)
+
         completion_time = datetime.now(pytz.timezone('Asia/Dhaka')).strftime('%Y-%m-%d %H:%M:%S %Z')
-        logging.info(f"All downloads and extractions completed successfully at {completion_time}")
-        
+        logging.info(f"All downloads and extractions completed at {completion_time}")
+
     except Exception as e:
         logging.error(f"Error: {str(e)}")
         sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
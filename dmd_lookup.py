@@ -0,0 +1,162 @@
+import os
+import re
+import sys
+import time
+import random
+import argparse
+import logging
+import zipfile
+import tracemalloc
+from typing import Dict, List, Optional, Tuple
+from dmd_parser import AMP, AMPP, VMP, VMPP, VTM, find_member, iter_records, release_name
+
+
+def latest_release(roots: Tuple[str, ...] = ('extracted', 'downloads')) -> Optional[str]:
+    """Return the newest dm+d release folder or zip, going by the date stamp in its name.
+
+    At equal stamps an extracted folder wins over the zip it came from.
+    """
+    releases = []
+    for preference, root in enumerate(reversed(roots)):
+        for name in os.listdir(root) if os.path.isdir(root) else []:
+            path = os.path.join(root, name)
+            if not (os.path.isdir(path) or name.lower().endswith('.zip')):
+                continue
+            try:
+                found = find_member(path, VMP.file_prefix)
+            except zipfile.BadZipFile:
+                continue
+            if found:
+                stamps = re.findall(r'\d{8,}', release_name(path))
+                releases.append((stamps[-1] if stamps else '', preference, os.path.getmtime(path), path))
+    return max(releases)[-1] if releases else None
+
+
+class ReleaseIndex:
+    """Hash indexes over one dm+d release for constant time lookups.
+
+    Products are indexed by their own ID (VTMID, VPID, APID, VPPID, APPID)
+    and children by parent ID (VTMID -> VPIDs, VPID -> APIDs and VPPIDs,
+    VPPID -> APPIDs). Everything is built once, after which the index is
+    read-only and safe to share between threads.
+    """
+
+    def __init__(self):
+        self.vtms: Dict[int, VTM] = {}
+        self.vmps: Dict[int, VMP] = {}
+        self.amps: Dict[int, AMP] = {}
+        self.vmpps: Dict[int, VMPP] = {}
+        self.ampps: Dict[int, AMPP] = {}
+        self.vmps_by_vtm: Dict[int, List[int]] = {}
+        self.amps_by_vmp: Dict[int, List[int]] = {}
+        self.vmpps_by_vmp: Dict[int, List[int]] = {}
+        self.ampps_by_vmpp: Dict[int, List[int]] = {}
+
+    @classmethod
+    def build(cls, source: str) -> 'ReleaseIndex':
+        """Build the indexes from a release folder or zip."""
+        index = cls()
+        for vtm in iter_records(source, VTM):
+            index.vtms[vtm.vtmid] = vtm
+        for vmp in iter_records(source, VMP):
+            index.vmps[vmp.vpid] = vmp
+            if vmp.vtmid is not None:
+                index.vmps_by_vtm.setdefault(vmp.vtmid, []).append(vmp.vpid)
+        for amp in iter_records(source, AMP):
+            index.amps[amp.apid] = amp
+            index.amps_by_vmp.setdefault(amp.vpid, []).append(amp.apid)
+        for vmpp in iter_records(source, VMPP):
+            index.vmpps[vmpp.vppid] = vmpp
+            index.vmpps_by_vmp.setdefault(vmpp.vpid, []).append(vmpp.vppid)
+        for ampp in iter_records(source, AMPP):
+            index.ampps[ampp.appid] = ampp
+            index.ampps_by_vmpp.setdefault(ampp.vppid, []).append(ampp.appid)
+        return index
+
+    def vtm(self, vtmid: int) -> Optional[VTM]:
+        return self.vtms.get(vtmid)
+
+    def vmp(self, vpid: int) -> Optional[VMP]:
+        return self.vmps.get(vpid)
+
+    def amp(self, apid: int) -> Optional[AMP]:
+        return self.amps.get(apid)
+
+    def vmpp(self, vppid: int) -> Optional[VMPP]:
+        return self.vmpps.get(vppid)
+
+    def ampp(self, appid: int) -> Optional[AMPP]:
+        return self.ampps.get(appid)
+
+    def vmps_for_vtm(self, vtmid: int) -> List[VMP]:
+        return [self.vmps[vpid] for vpid in self.vmps_by_vtm.get(vtmid, ())]
+
+    def amps_for_vmp(self, vpid: int) -> List[AMP]:
+        return [self.amps[apid] for apid in self.amps_by_vmp.get(vpid, ())]
+
+    def vmpps_for_vmp(self, vpid: int) -> List[VMPP]:
+        return [self.vmpps[vppid] for vppid in self.vmpps_by_vmp.get(vpid, ())]
+
+    def ampps_for_vmpp(self, vppid: int) -> List[AMPP]:
+        return [self.ampps[appid] for appid in self.ampps_by_vmpp.get(vppid, ())]
+
+    def vmp_with_amps(self, code: int) -> Optional[Tuple[VMP, List[AMP]]]:
+        """Return the VMP and all its AMPs for a VPID, or for the APID of one of the AMPs."""
+        code = int(code)
+        vmp = self.vmps.get(code)
+        if vmp is None:
+            amp = self.amps.get(code)
+            vmp = self.vmps.get(amp.vpid) if amp is not None else None
+        if vmp is None:
+            return None
+        return vmp, self.amps_for_vmp(vmp.vpid)
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the in-memory DM+D lookup indexes.")
+    parser.add_argument('release', nargs='?',
+                        help="release folder or zip (default: the latest one under extracted/ or downloads/)")
+    parser.add_argument('--lookups', type=int, default=100000,
+                        help="VMP lookups timed (default: %(default)s)")
+    parser.add_argument('--memory', action='store_true',
+                        help="also measure the memory held by the indexes (builds them a second time)")
+    return parser.parse_args(argv)
+
+
+def main(argv: list = None):
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    args = parse_args(argv)
+
+    source = args.release or latest_release()
+    if source is None or not os.path.exists(source):
+        logging.error("Error: no release found")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    index = ReleaseIndex.build(source)
+    logging.info(f"Built indexes over {len(index.vmps)} VMPs, {len(index.amps)} AMPs, "
+                 f"{len(index.vmpps)} VMPPs and {len(index.ampps)} AMPPs from {source} "
+                 f"in {time.perf_counter() - start:.2f}s")
+
+    if args.memory:
+        tracemalloc.start()
+        measured = ReleaseIndex.build(source)
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del measured
+        logging.info(f"Indexes hold {size / 1024 / 1024:.1f} MiB")
+
+    codes = list(index.vmps) + list(index.amps)
+    if not codes:
+        return
+    codes = [random.choice(codes) for _ in range(args.lookups)]
+    start = time.perf_counter()
+    for code in codes:
+        index.vmp_with_amps(code)
+    elapsed = time.perf_counter() - start
+    logging.info(f"{args.lookups} VMP and AMP lookups in {elapsed:.3f}s "
+                 f"({elapsed / args.lookups * 1e6:.2f} µs per lookup)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import logging
+import tracemalloc
+import tempfile
+import zipfile
+import xml.etree.ElementTree as ET
+from contextlib import ExitStack, contextmanager
+from functools import lru_cache
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple, Type
+
+# Fields converted from text; everything else (names, dates, codes that may
+# carry leading zeros) stays a string
+INT_FIELDS = {
+    'vtmid', 'vtmidprev', 'vpid', 'vpidprev', 'apid', 'vppid', 'appid', 'isid', 'isidprev',
+    'bs_subid', 'invalid', 'sug_f', 'glu_f', 'pres_f', 'cfc_f', 'ema', 'parallel_import'
+}
+FLOAT_FIELDS = {'udfs', 'qtyval', 'strnt_nmrtr_val', 'strnt_dnmtr_val'}
+
+NESTED = '!/'  # separates a zip inside a release from the file inside that zip
+SPOOL_SIZE = 64 * 1024 * 1024  # nested zips up to this size are opened in memory
+
+
+def convert(field: str, text: Optional[str]):
+    if text is None:
+        return None
+    if field in INT_FIELDS:
+        return int(text)
+    if field in FLOAT_FIELDS:
+        return float(text)
+    if field.endswith(('cd', 'dt')):
+        # Codes and dates repeat across most records; keep one copy of each
+        return sys.intern(text)
+    return text
+
+
+class Record:
+    """Base class of dm+d records.
+
+    Subclasses list their fields in __slots__ (the lower-cased element names
+    of the release files), the element holding one record in ``tag``, the
+    release file it comes from in ``file_prefix`` and the fields identifying
+    a record in ``key``.
+    """
+    __slots__ = ()
+    tag = None
+    file_prefix = None
+    key = ()
+
+    def __init__(self, **values):
+        for field in self.__slots__:
+            setattr(self, field, values.get(field))
+
+    @classmethod
+    def from_element(cls, element: ET.Element, parent: ET.Element) -> Iterator['Record']:
+        """Build the records held by one record element."""
+        yield cls(**{child.tag.lower(): convert(child.tag.lower(), child.text) for child in element})
+
+    @property
+    def id(self):
+        """The key value, or a tuple of values for composite keys."""
+        if len(self.key) == 1:
+            return getattr(self, self.key[0])
+        return tuple(getattr(self, field) for field in self.key)
+
+    def astuple(self) -> tuple:
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    def asdict(self) -> Dict:
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.astuple() == other.astuple()
+
+    def __hash__(self):
+        return hash(self.astuple())
+
+    def __repr__(self):
+        values = ', '.join(f"{field}={getattr(self, field)!r}" for field in self.__slots__)
+        return f"{type(self).__name__}({values})"
+
+
+class VTM(Record):
+    """Virtual therapeutic moiety."""
+    __slots__ = ('vtmid', 'invalid', 'nm', 'abbrevnm', 'vtmidprev', 'vtmiddt')
+    tag = 'VTM'
+    file_prefix = 'f_vtm2_'
+    key = ('vtmid',)
+
+
+class VMP(Record):
+    """Virtual medicinal product."""
+    __slots__ = ('vpid', 'vpiddt', 'vpidprev', 'vtmid', 'invalid', 'nm', 'abbrevnm', 'basiscd',
+                 'nmdt', 'nmprev', 'basis_prevcd', 'nmchangecd', 'combprodcd', 'pres_statcd',
+                 'sug_f', 'glu_f', 'pres_f', 'cfc_f', 'non_availcd', 'non_availdt', 'df_indcd',
+                 'udfs', 'udfs_uomcd', 'unit_dose_uomcd')
+    tag = 'VMP'
+    file_prefix = 'f_vmp2_'
+    key = ('vpid',)
+
+
+class VPI(Record):
+    """Ingredient of a virtual medicinal product, with its strength."""
+    __slots__ = ('vpid', 'isid', 'basis_strntcd', 'bs_subid', 'strnt_nmrtr_val', 'strnt_nmrtr_uomcd',
+                 'strnt_dnmtr_val', 'strnt_dnmtr_uomcd')
+    tag = 'VPI'
+    file_prefix = 'f_vmp2_'
+    key = ('vpid', 'isid')
+
+
+class AMP(Record):
+    """Actual medicinal product."""
+    __slots__ = ('apid', 'invalid', 'vpid', 'nm', 'abbrevnm', 'desc', 'nmdt', 'nm_prev', 'suppcd',
+                 'lic_authcd', 'lic_auth_prevcd', 'lic_authchangecd', 'lic_authchangedt',
+                 'combprodcd', 'flavourcd', 'ema', 'parallel_import', 'avail_restrictcd')
+    tag = 'AMP'
+    file_prefix = 'f_amp2_'
+    key = ('apid',)
+
+
+class VMPP(Record):
+    """Virtual medicinal product pack."""
+    __slots__ = ('vppid', 'invalid', 'nm', 'vpid', 'qtyval', 'qty_uomcd', 'combpackcd')
+    tag = 'VMPP'
+    file_prefix = 'f_vmpp2_'
+    key = ('vppid',)
+
+
+class AMPP(Record):
+    """Actual medicinal product pack."""
+    __slots__ = ('appid', 'invalid', 'nm', 'abbrevnm', 'vppid', 'apid', 'combpackcd', 'legal_catcd',
+                 'subp', 'disccd', 'discdt')
+    tag = 'AMPP'
+    file_prefix = 'f_ampp2_'
+    key = ('appid',)
+
+
+class Ingredient(Record):
+    """Ingredient substance."""
+    __slots__ = ('isid', 'isiddt', 'isidprev', 'invalid', 'nm')
+    tag = 'ING'
+    file_prefix = 'f_ingredient2_'
+    key = ('isid',)
+
+
+class Lookup(Record):
+    """Entry of one of the lookup tables, e.g. UNIT_OF_MEASURE or ROUTE."""
+    __slots__ = ('table', 'cd', 'cddt', 'cdprev', 'desc')
+    tag = 'INFO'
+    file_prefix = 'f_lookup2_'
+    key = ('table', 'cd')
+
+    @classmethod
+    def from_element(cls, element: ET.Element, parent: ET.Element) -> Iterator['Lookup']:
+        yield cls(table=parent.tag, **{child.tag.lower(): child.text for child in element})
+
+
+class GTIN(Record):
+    """GTIN (barcode) of an actual medicinal product pack, from the GTIN release file."""
+    __slots__ = ('appid', 'gtin', 'startdt', 'enddt')
+    tag = 'AMPP'
+    file_prefix = 'f_gtin2_'
+    key = ('appid', 'gtin')
+
+    @classmethod
+    def from_element(cls, element: ET.Element, parent: ET.Element) -> Iterator['GTIN']:
+        appid = convert('appid', element.findtext('AMPPID'))
+        for data in element.iter('GTINDATA'):
+            yield cls(appid=appid, gtin=data.findtext('GTIN'),
+                      startdt=data.findtext('STARTDT'), enddt=data.findtext('ENDDT'))
+
+
+RECORD_TYPES = (VTM, VMP, VPI, AMP, VMPP, AMPP, Ingredient, Lookup, GTIN)
+
+
+def table_name(record_type: Type[Record]) -> str:
+    """Name of the table or file a record type is stored under, e.g. vmp."""
+    return record_type.__name__.lower()
+
+
+def parse_records(stream: BinaryIO, record_type: Type[Record]) -> Iterator[Record]:
+    """Stream the records of one type out of a dm+d XML file.
+
+    Elements are dropped from the tree as soon as the record (or section)
+    holding them has been read, so memory stays flat however large the file.
+    """
+    path = []
+    for event, element in ET.iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            path.append(element)
+            continue
+
+        path.pop()
+        if element.tag == record_type.tag and len(path) <= 2:
+            yield from record_type.from_element(element, path[-1] if path else None)
+        if len(path) == 1 or (len(path) == 2 and path[-1].tag != record_type.tag):
+            # Records sit right below the root or in a section below it; forget
+            # them (and their sections) once read, but keep the fields of a
+            # record until the record itself ends
+            path[-1].remove(element)
+
+
+def release_name(source: str) -> str:
+    """Name of a release folder or archive, without the .zip extension."""
+    name = os.path.basename(os.path.normpath(source))
+    return name[:-len('.zip')] if name.lower().endswith('.zip') else name
+
+
+@contextmanager
+def open_nested(archive: zipfile.ZipFile, name: str) -> Iterator[zipfile.ZipFile]:
+    """Open a zip stored inside another one.
+
+    zipfile has to seek around an archive, which a compressed member does not
+    allow cheaply, so the inner zip is spooled to memory (or a temporary
+    file when large) first.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as spool:
+        with archive.open(name) as member:
+            shutil.copyfileobj(member, spool, 1024 * 1024)
+        spool.seek(0)
+        with zipfile.ZipFile(spool) as nested:
+            yield nested
+
+
+@lru_cache(maxsize=16)
+def archive_members(path: str, size: int, mtime_ns: int) -> Tuple[str, ...]:
+    """Files in a zip, and in the zips inside it as <zip>!/<file>; cached per archive version."""
+    with zipfile.ZipFile(path) as archive:
+        names = [info.filename for info in archive.infolist() if not info.is_dir()]
+        nested = []
+        for name in names:
+            if name.lower().endswith('.zip'):
+                with open_nested(archive, name) as inner:
+                    nested += [name + NESTED + info.filename for info in inner.infolist() if not info.is_dir()]
+    return tuple(names + nested)
+
+
+def list_members(source: str) -> List[str]:
+    """List the files of a release folder or archive, relative to it.
+
+    Files inside zips one level down (e.g. the GTIN zip) are listed as
+    <zip>!/<file>, after the plain files.
+    """
+    if not os.path.isdir(source):
+        stat = os.stat(source)
+        members = archive_members(os.path.abspath(source), stat.st_size, stat.st_mtime_ns)
+    else:
+        members = []
+        for folder, dirs, files in os.walk(source):
+            for name in files:
+                path = os.path.join(folder, name)
+                member = os.path.relpath(path, source).replace(os.sep, '/')
+                members.append(member)
+                if name.lower().endswith('.zip') and zipfile.is_zipfile(path):
+                    stat = os.stat(path)
+                    members += [member + NESTED + inner
+                                for inner in archive_members(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+                                if NESTED not in inner]
+    return sorted(members, key=lambda member: (NESTED in member, member))
+
+
+def find_member(source: str, file_prefix: str) -> Optional[str]:
+    """Find the release file with the given prefix in a release folder or archive."""
+    for member in list_members(source):
+        name = member.rsplit('/', 1)[-1]
+        if name.startswith(file_prefix) and name.endswith('.xml'):
+            return member
+    return None
+
+
+@contextmanager
+def open_member(source: str, file_prefix: str) -> Iterator[BinaryIO]:
+    """Open the release file with the given prefix for reading, straight from the zip when source is one."""
+    member = find_member(source, file_prefix)
+    if member is None:
+        raise FileNotFoundError(f"No {file_prefix}*.xml file in {source}")
+
+    outer, _, inner = member.partition(NESTED)
+    with ExitStack() as stack:
+        if os.path.isdir(source):
+            path = os.path.join(source, *outer.split('/'))
+            if not inner:
+                yield stack.enter_context(open(path, 'rb'))
+                return
+            archive = stack.enter_context(zipfile.ZipFile(path))
+        else:
+            archive = stack.enter_context(zipfile.ZipFile(source))
+            if inner:
+                archive = stack.enter_context(open_nested(archive, outer))
+            else:
+                inner = outer
+        yield stack.enter_context(archive.open(inner))
+
+
+def iter_records(source: str, record_type: Type[Record]) -> Iterator[Record]:
+    """Stream the records of one type from an extracted release folder or a release zip."""
+    with open_member(source, record_type.file_prefix) as f:
+        yield from parse_records(f, record_type)
+
+
+def available_types(source: str) -> List[Type[Record]]:
+    """List the record types whose release file is present in source."""
+    return [record_type for record_type in RECORD_TYPES
+            if find_member(source, record_type.file_prefix) is not None]
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Time the streaming parse of each file of a DM+D release.")
+    parser.add_argument('release', help="release folder or zip")
+    parser.add_argument('--memory', action='store_true',
+                        help="also trace the peak memory of each parse (several times slower)")
+    return parser.parse_args(argv)
+
+
+def main(argv: list = None):
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    args = parse_args(argv)
+
+    if not os.path.exists(args.release):
+        logging.error(f"Error: {args.release} does not exist")
+        sys.exit(1)
+
+    for record_type in available_types(args.release):
+        if args.memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        with open_member(args.release, record_type.file_prefix) as f:
+            # Records are dropped as they come, as a loader streaming them would
+            count = sum(1 for _ in parse_records(f, record_type))
+            size = f.tell()
+        elapsed = time.perf_counter() - start
+        line = (f"{table_name(record_type):10} {count:8} records from {size / 1024 / 1024:7.1f} MiB "
+                f"in {elapsed:6.2f}s")
+        if args.memory:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            line += f", peak {peak / 1024 / 1024:.1f} MiB"
+        logging.info(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+import os
+import re
+import sys
+import time
+import heapq
+import random
+import argparse
+import logging
+import tracemalloc
+from bisect import bisect_left
+from itertools import chain
+from typing import Dict, Iterable, List, Optional, Set
+from dmd_parser import AMP, VMP, Record, iter_records
+from dmd_lookup import latest_release
+
+TOKEN_PATTERN = re.compile(r'[a-z]+|\d+(?:\.\d+)?')
+# Hits on the generic product come before its branded ones at equal scores
+KIND_ORDER = {'vmp': 0, 'amp': 1}
+FUZZY_THRESHOLD = 0.45
+FUZZY_CANDIDATES = 5
+
+
+def tokenize(text: str) -> List[str]:
+    """Split a name into lower-case words and numbers, e.g. 500mg -> 500, mg."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def trigrams(token: str) -> Set[str]:
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchHit:
+    __slots__ = ('kind', 'id', 'name', 'score')
+
+    def __init__(self, kind: str, id: int, name: str, score: float):
+        self.kind = kind
+        self.id = id
+        self.name = name
+        self.score = score
+
+    def __repr__(self):
+        return f"SearchHit({self.kind}, {self.id}, {self.name!r}, {self.score:.2f})"
+
+
+class SearchIndex:
+    """Search VMP and AMP names by partial words, with typo tolerance.
+
+    Distinct names are split into tokens held in an inverted index (token ->
+    names containing it); many AMPs share their name with the VMP, so each
+    name is matched once for all its products. Every query word matches as a
+    prefix, found by bisecting the sorted vocabulary, which serves as a
+    flattened prefix trie; a word that prefixes nothing falls back to the
+    vocabulary tokens sharing the most trigrams with it. A name must match
+    every query word. Exact words score above prefixes, and prefixes above
+    fuzzy matches.
+
+    Names are numbered in tie-break order (VMP names first, then shorter
+    names), so when enough names match every word through its best-scoring
+    tokens the hits are simply the lowest numbers among them, found with set
+    operations instead of scoring each candidate.
+    """
+
+    def __init__(self):
+        self.names: List[str] = []
+        self.name_tokens: List[tuple] = []
+        # Products carrying each name as (kind, id), VMPs first
+        self.products: List[List[tuple]] = []
+        self.postings: Dict[str, frozenset] = {}
+        self.kind_names: Dict[str, frozenset] = {}
+        self.vocabulary: List[str] = []
+        self.trigram_index: Dict[str, List[str]] = {}
+
+    @classmethod
+    def build(cls, source: str, include_invalid: bool = False) -> 'SearchIndex':
+        """Build the index over the VMP and AMP names of a release folder or zip."""
+        return cls.from_records(chain(iter_records(source, VMP), iter_records(source, AMP)), include_invalid)
+
+    @classmethod
+    def from_records(cls, records: Iterable[Record], include_invalid: bool = False) -> 'SearchIndex':
+        """Build the index over VMP and AMP records, e.g. those of a ReleaseIndex."""
+        products_by_name = {}
+        for record in records:
+            if record.nm is None or (record.invalid and not include_invalid):
+                continue
+            kind = 'vmp' if isinstance(record, VMP) else 'amp'
+            products_by_name.setdefault(record.nm, []).append((kind, record.id))
+
+        index = cls()
+        postings = {}
+        kind_names = {kind: [] for kind in KIND_ORDER}
+        for products in products_by_name.values():
+            products.sort(key=lambda product: KIND_ORDER[product[0]])
+        ordered = sorted(products_by_name.items(),
+                         key=lambda item: (KIND_ORDER[item[1][0][0]], len(item[0]), item[0]))
+        for name, (text, products) in enumerate(ordered):
+            index.names.append(text)
+            index.products.append(products)
+            tokens = tuple(dict.fromkeys(sys.intern(token) for token in tokenize(text)))
+            index.name_tokens.append(tokens)
+            for token in tokens:
+                postings.setdefault(token, []).append(name)
+            for kind in {kind for kind, _ in products}:
+                kind_names[kind].append(name)
+
+        index.postings = {token: frozenset(names) for token, names in postings.items()}
+        index.kind_names = {kind: frozenset(names) for kind, names in kind_names.items()}
+        index.vocabulary = sorted(postings)
+        for token in index.vocabulary:
+            for trigram in trigrams(token):
+                index.trigram_index.setdefault(trigram, []).append(token)
+        return index
+
+    def prefix_matches(self, word: str) -> Dict[str, float]:
+        """Vocabulary tokens starting with word, weighted by how much of them it covers."""
+        matches = {}
+        for position in range(bisect_left(self.vocabulary, word), len(self.vocabulary)):
+            token = self.vocabulary[position]
+            if not token.startswith(word):
+                break
+            matches[token] = 1.0 if token == word else 0.5 + 0.4 * len(word) / len(token)
+        return matches
+
+    def fuzzy_matches(self, word: str) -> Dict[str, float]:
+        """Vocabulary tokens most similar to word by trigram overlap."""
+        word_trigrams = trigrams(word)
+        shared = {}
+        for trigram in word_trigrams:
+            for token in self.trigram_index.get(trigram, ()):
+                shared[token] = shared.get(token, 0) + 1
+        scored = []
+        for token, count in shared.items():
+            # Jaccard similarity; a token has len + 1 padded trigrams
+            similarity = count / (len(word_trigrams) + len(token) + 1 - count)
+            if similarity >= FUZZY_THRESHOLD:
+                scored.append((similarity, token))
+        return {token: 0.5 * similarity for similarity, token in heapq.nlargest(FUZZY_CANDIDATES, scored)}
+
+    def names_matching(self, tokens: Iterable[str]) -> frozenset:
+        postings = [self.postings[token] for token in tokens]
+        return postings[0] if len(postings) == 1 else frozenset().union(*postings)
+
+    def search(self, query: str, limit: int = 10, kinds: Optional[Iterable[str]] = None) -> List[SearchHit]:
+        """Return the best matching products for a query such as 'amoxi 500', best first."""
+        words = list(dict.fromkeys(tokenize(query)))
+        if not words:
+            return []
+
+        word_matches = []
+        for word in words:
+            matches = self.prefix_matches(word) or self.fuzzy_matches(word)
+            if not matches:
+                return []
+            word_matches.append(matches)
+
+        candidates = frozenset.intersection(*sorted(
+            (self.names_matching(matches) for matches in word_matches), key=len
+        ))
+        if kinds is not None:
+            candidates &= frozenset().union(*(self.kind_names.get(kind, frozenset()) for kind in kinds))
+            kinds = set(kinds)
+        if not candidates:
+            return []
+
+        # Names matching every word through its best-scoring tokens share the top score
+        best = candidates
+        best_score = 0.0
+        for matches in word_matches:
+            top = max(matches.values())
+            best_score += top
+            best = best & self.names_matching(token for token, weight in matches.items() if weight == top)
+
+        if len(best) >= limit:
+            ranked = [(name, best_score) for name in heapq.nsmallest(limit, best)]
+        else:
+            scores = dict.fromkeys(candidates, 0.0)
+            for matches in word_matches:
+                for name in candidates:
+                    scores[name] += max(matches.get(token, 0) for token in self.name_tokens[name])
+            ranked = heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], item[0]))
+
+        # Every name holds at least one product, so the best limit names are enough
+        hits = []
+        for name, score in ranked:
+            for kind, product_id in self.products[name]:
+                if kinds is None or kind in kinds:
+                    hits.append(SearchHit(kind, product_id, self.names[name], score))
+            if len(hits) >= limit:
+                break
+        return hits[:limit]
+
+
+def sample_queries(index: SearchIndex, count: int) -> List[str]:
+    """Queries like clinicians type them: word prefixes, a strength, now and then a typo."""
+    queries = []
+    for _ in range(count):
+        tokens = index.name_tokens[random.randrange(len(index.names))]
+        words = [token if token[0].isdigit() else token[:random.randint(3, max(3, len(token)))]
+                 for token in tokens[:2]]
+        if random.random() < 0.1 and len(words[0]) > 4:
+            position = random.randrange(1, len(words[0]) - 1)
+            words[0] = words[0][:position] + words[0][position + 1:]
+        queries.append(' '.join(words))
+    return queries
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Search DM+D product names, or benchmark the search index.")
+    parser.add_argument('query', nargs='*', help="words to search for; without any, run the benchmark")
+    parser.add_argument('--release',
+                        help="release folder or zip (default: the latest one under extracted/ or downloads/)")
+    parser.add_argument('--limit', type=int, default=10, help="hits shown (default: %(default)s)")
+    parser.add_argument('--queries', type=int, default=10000,
+                        help="queries timed by the benchmark (default: %(default)s)")
+    parser.add_argument('--memory', action='store_true',
+                        help="also measure the memory held by the index (builds it a second time)")
+    return parser.parse_args(argv)
+
+
+def main(argv: list = None):
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    args = parse_args(argv)
+
+    source = args.release or latest_release()
+    if source is None or not os.path.exists(source):
+        logging.error("Error: no release found")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    index = SearchIndex.build(source)
+    logging.info(f"Indexed {sum(map(len, index.products))} products under {len(index.names)} names "
+                 f"({len(index.vocabulary)} distinct words) from {source} "
+                 f"in {time.perf_counter() - start:.2f}s")
+
+    if args.query:
+        for hit in index.search(' '.join(args.query), limit=args.limit):
+            logging.info(f"{hit.score:5.2f}  {hit.kind.upper():4} {hit.id}  {hit.name}")
+        return
+
+    if args.memory:
+        tracemalloc.start()
+        measured = SearchIndex.build(source)
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del measured
+        logging.info(f"Index holds {size / 1024 / 1024:.1f} MiB")
+
+    if not index.names:
+        return
+    queries = sample_queries(index, args.queries)
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query, limit=args.limit)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    logging.info(f"{len(queries)} queries: median {timings[len(timings) // 2] * 1000:.3f} ms, "
+                 f"p95 {timings[int(len(timings) * 0.95)] * 1000:.3f} ms, "
+                 f"max {timings[-1] * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+import os
+import sys
+import json
+import mmap
+import time
+import random
+import struct
+import argparse
+import logging
+from bisect import bisect_left, bisect_right
+from typing import BinaryIO, Dict, List, Optional, Tuple, Type
+from dmd_parser import AMP, AMPP, FLOAT_FIELDS, INT_FIELDS, Ingredient, Record, VMP, VMPP, VTM, \
+    iter_records, release_name, table_name
+
+MAGIC = b'DMDSNAP1'
+FOOTER = struct.Struct('<Q8s')  # directory length, magic
+NULL_INT = -2 ** 63
+NULL_FLAG = -1
+NULL_STRING = 0xFFFFFFFF
+# Integer fields that only hold 0/1 and are stored in one byte
+FLAG_FIELDS = {'invalid', 'sug_f', 'glu_f', 'pres_f', 'cfc_f', 'ema', 'parallel_import'}
+
+# Record types stored in a snapshot, all keyed by a single integer ID
+SNAPSHOT_TYPES = (VTM, VMP, AMP, VMPP, AMPP, Ingredient)
+# Parent ID arrays, e.g. every AMP of a VPID through ('amp', 'vpid')
+CHILD_INDEXES = (('vmp', 'vtmid'), ('amp', 'vpid'), ('vmpp', 'vpid'), ('ampp', 'vppid'), ('ampp', 'apid'))
+
+
+def field_format(field: str) -> str:
+    if field in FLAG_FIELDS:
+        return 'b'
+    if field in INT_FIELDS:
+        return 'q'
+    if field in FLOAT_FIELDS:
+        return 'd'
+    return 'IH'  # offset and length in the string table
+
+
+def record_struct(record_type: Type[Record]) -> struct.Struct:
+    return struct.Struct('<' + ''.join(field_format(field) for field in record_type.__slots__))
+
+
+class SnapshotWriter:
+    """Write a release to a snapshot file.
+
+    Layout: for every record type a sorted int64 array of IDs and the
+    fixed-width records in the same order, then the parent ID arrays, then
+    one string table shared by all records (each distinct string stored
+    once), and finally a JSON directory of section offsets followed by its
+    length and the magic bytes. Sections are 8-byte aligned.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.strings: Dict[str, Tuple[int, int]] = {}
+        self.string_data = bytearray()
+        self.directory = {'tables': {}, 'indexes': {}}
+
+    def string_ref(self, text: Optional[str]) -> Tuple[int, int]:
+        if text is None:
+            return NULL_STRING, 0
+        ref = self.strings.get(text)
+        if ref is None:
+            data = text.encode('utf-8')
+            if len(data) > 0xFFFF:
+                raise ValueError(f"String of {len(data)} bytes is too long for a snapshot")
+            ref = self.strings[text] = (len(self.string_data), len(data))
+            self.string_data += data
+        return ref
+
+    def pack_values(self, record: Record) -> list:
+        values = []
+        for field in record.__slots__:
+            value = getattr(record, field)
+            if field in FLAG_FIELDS:
+                values.append(NULL_FLAG if value is None else value)
+            elif field in INT_FIELDS:
+                values.append(NULL_INT if value is None else value)
+            elif field in FLOAT_FIELDS:
+                values.append(float('nan') if value is None else value)
+            else:
+                values.extend(self.string_ref(value))
+        return values
+
+    def write_section(self, f: BinaryIO, data: bytes) -> int:
+        """Write an 8-byte aligned section, returning its offset."""
+        offset = f.tell()
+        f.write(data)
+        f.write(b'\0' * (-len(data) % 8))
+        return offset
+
+    def write_table(self, f: BinaryIO, record_type: Type[Record], records: List[Record]):
+        key = record_type.key[0]
+        records.sort(key=lambda record: getattr(record, key))
+        packer = record_struct(record_type)
+        ids = struct.pack(f'<{len(records)}q', *(getattr(record, key) for record in records))
+        rows = b''.join(packer.pack(*self.pack_values(record)) for record in records)
+        self.directory['tables'][table_name(record_type)] = {
+            'count': len(records),
+            'ids': self.write_section(f, ids),
+            'records': self.write_section(f, rows)
+        }
+
+    def write_index(self, f: BinaryIO, table: str, field: str, records: List[Record]):
+        # Records are already sorted by ID, so positions point straight at them
+        pairs = sorted((getattr(record, field), position) for position, record in enumerate(records)
+                       if getattr(record, field) is not None)
+        self.directory['indexes'][f"{table}.{field}"] = {
+            'count': len(pairs),
+            'keys': self.write_section(f, struct.pack(f'<{len(pairs)}q', *(key for key, _ in pairs))),
+            'positions': self.write_section(f, struct.pack(f'<{len(pairs)}q', *(pos for _, pos in pairs)))
+        }
+
+    def write(self, source: str) -> Dict[str, int]:
+        """Write the snapshot of a release folder or zip, returning the record counts."""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+            for record_type in SNAPSHOT_TYPES:
+                records = list(iter_records(source, record_type))
+                self.write_table(f, record_type, records)
+                table = table_name(record_type)
+                for index_table, field in CHILD_INDEXES:
+                    if index_table == table:
+                        self.write_index(f, table, field, records)
+
+            self.directory['strings'] = self.write_section(f, bytes(self.string_data))
+            self.directory['release'] = release_name(source)
+            directory = json.dumps(self.directory).encode('utf-8')
+            f.write(directory)
+            f.write(FOOTER.pack(len(directory), MAGIC))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        return {table: entry['count'] for table, entry in self.directory['tables'].items()}
+
+
+class Snapshot:
+    """Read-only view of a snapshot file through mmap.
+
+    Opening only reads the directory; lookups binary search the sorted ID
+    arrays and decode the one record they hit, so startup is immediate and
+    every process mapping the same file shares its pages. The lookup methods
+    mirror ReleaseIndex.
+    """
+
+    RECORD_TYPES = {table_name(record_type): record_type for record_type in SNAPSHOT_TYPES}
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mmap)
+
+        directory_length, magic = FOOTER.unpack_from(self.mmap, len(self.mmap) - FOOTER.size)
+        if magic != MAGIC or self.mmap[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a dm+d snapshot")
+        directory_start = len(self.mmap) - FOOTER.size - directory_length
+        self.directory = json.loads(bytes(self.view[directory_start:directory_start + directory_length]))
+        self.release = self.directory['release']
+        self.strings = self.directory['strings']
+
+        # Per table: record type, records offset, struct and how to decode each field
+        self.plans = {table: self.decode_plan(table) for table in self.directory['tables']}
+        self.ids = {table: self.int_array(entry['ids'], entry['count'])
+                    for table, entry in self.directory['tables'].items()}
+        self.index_keys = {name: self.int_array(entry['keys'], entry['count'])
+                           for name, entry in self.directory['indexes'].items()}
+        self.index_positions = {name: self.int_array(entry['positions'], entry['count'])
+                                for name, entry in self.directory['indexes'].items()}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        # Views into the mapping have to go before the mapping itself
+        for arrays in (getattr(self, 'ids', {}), getattr(self, 'index_keys', {}),
+                       getattr(self, 'index_positions', {})):
+            for array in arrays.values():
+                array.release()
+        self.view.release()
+        self.mmap.close()
+
+    def int_array(self, offset: int, count: int) -> memoryview:
+        return self.view[offset:offset + count * 8].cast('q')
+
+    def decode_plan(self, table: str) -> tuple:
+        record_type = self.RECORD_TYPES[table]
+        fields = []
+        position = 0
+        for field in record_type.__slots__:
+            if field in FLAG_FIELDS:
+                fields.append((field, NULL_FLAG, position))
+            elif field in INT_FIELDS:
+                fields.append((field, NULL_INT, position))
+            elif field in FLOAT_FIELDS:
+                fields.append((field, None, position))
+            else:
+                fields.append((field, NULL_STRING, position))
+            position += len(field_format(field))
+        return record_type, self.directory['tables'][table]['records'], record_struct(record_type), fields
+
+    def decode(self, table: str, position: int) -> Record:
+        record_type, records, packer, fields = self.plans[table]
+        packed = packer.unpack_from(self.mmap, records + position * packer.size)
+        record = record_type.__new__(record_type)
+        for field, null, index in fields:
+            value = packed[index]
+            if null is NULL_STRING:
+                if value == NULL_STRING:
+                    value = None
+                else:
+                    start = self.strings + value
+                    value = self.mmap[start:start + packed[index + 1]].decode('utf-8')
+            elif null is None:
+                # NaN marks a missing float
+                if value != value:
+                    value = None
+            elif value == null:
+                value = None
+            setattr(record, field, value)
+        return record
+
+    def get(self, table: str, key: int) -> Optional[Record]:
+        ids = self.ids[table]
+        position = bisect_left(ids, key)
+        if position < len(ids) and ids[position] == key:
+            return self.decode(table, position)
+        return None
+
+    def children(self, table: str, field: str, key: int) -> List[Record]:
+        name = f"{table}.{field}"
+        keys = self.index_keys[name]
+        positions = self.index_positions[name]
+        return [self.decode(table, positions[i])
+                for i in range(bisect_left(keys, key), bisect_right(keys, key))]
+
+    def vtm(self, vtmid: int) -> Optional[VTM]:
+        return self.get('vtm', vtmid)
+
+    def vmp(self, vpid: int) -> Optional[VMP]:
+        return self.get('vmp', vpid)
+
+    def amp(self, apid: int) -> Optional[AMP]:
+        return self.get('amp', apid)
+
+    def vmpp(self, vppid: int) -> Optional[VMPP]:
+        return self.get('vmpp', vppid)
+
+    def ampp(self, appid: int) -> Optional[AMPP]:
+        return self.get('ampp', appid)
+
+    def vmps_for_vtm(self, vtmid: int) -> List[VMP]:
+        return self.children('vmp', 'vtmid', vtmid)
+
+    def amps_for_vmp(self, vpid: int) -> List[AMP]:
+        return self.children('amp', 'vpid', vpid)
+
+    def vmpps_for_vmp(self, vpid: int) -> List[VMPP]:
+        return self.children('vmpp', 'vpid', vpid)
+
+    def ampps_for_vmpp(self, vppid: int) -> List[AMPP]:
+        return self.children('ampp', 'vppid', vppid)
+
+    def vmp_with_amps(self, code: int) -> Optional[Tuple[VMP, List[AMP]]]:
+        """Return the VMP and all its AMPs for a VPID, or for the APID of one of the AMPs."""
+        code = int(code)
+        vmp = self.vmp(code)
+        if vmp is None:
+            amp = self.amp(code)
+            vmp = self.vmp(amp.vpid) if amp is not None else None
+        if vmp is None:
+            return None
+        return vmp, self.amps_for_vmp(vmp.vpid)
+
+
+def verify(snapshot: Snapshot, source: str) -> List[str]:
+    """Read every record and parent index back from a snapshot and compare them with the release it was written from."""
+    problems = []
+    if snapshot.release != release_name(source):
+        problems.append(f"release is {snapshot.release}, expected {release_name(source)}")
+    for record_type in SNAPSHOT_TYPES:
+        table = table_name(record_type)
+        key = record_type.key[0]
+        records = list(iter_records(source, record_type))
+        if len(snapshot.ids[table]) != len(records):
+            problems.append(f"{table}: {len(snapshot.ids[table])} records, expected {len(records)}")
+        for record in records:
+            stored = snapshot.get(table, getattr(record, key))
+            if stored != record:
+                problems.append(f"{table}: read back {stored!r}, expected {record!r}")
+
+        for index_table, field in CHILD_INDEXES:
+            if index_table != table:
+                continue
+            expected: Dict[int, List[int]] = {}
+            for record in records:
+                if getattr(record, field) is not None:
+                    expected.setdefault(getattr(record, field), []).append(getattr(record, key))
+            if len(snapshot.index_keys[f"{table}.{field}"]) != sum(map(len, expected.values())):
+                problems.append(f"{table}.{field}: {len(snapshot.index_keys[f'{table}.{field}'])} entries, "
+                                f"expected {sum(map(len, expected.values()))}")
+            for parent, ids in expected.items():
+                found = sorted(getattr(child, key) for child in snapshot.children(table, field, parent))
+                if found != sorted(ids):
+                    problems.append(f"{table}.{field} {parent}: children {found}, expected {sorted(ids)}")
+    return problems
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Write a DM+D release snapshot and time lookups against it.")
+    parser.add_argument('release', help="release folder or zip")
+    parser.add_argument('--output', metavar='FILE',
+                        help="snapshot file to write (default: <release>.dmdsnap next to the release)")
+    parser.add_argument('--lookups', type=int, default=100000,
+                        help="VMP lookups timed (default: %(default)s)")
+    parser.add_argument('--verify', action='store_true',
+                        help="read every record back and compare it with the release before timing lookups")
+    return parser.parse_args(argv)
+
+
+def main(argv: list = None):
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    args = parse_args(argv)
+
+    if not os.path.exists(args.release):
+        logging.error(f"Error: {args.release} does not exist")
+        sys.exit(1)
+    output = args.output or os.path.join(os.path.dirname(os.path.normpath(args.release)),
+                                         release_name(args.release) + '.dmdsnap')
+
+    start = time.perf_counter()
+    counts = SnapshotWriter(output).write(args.release)
+    logging.info(f"Wrote {sum(counts.values())} records to {output} ({os.path.getsize(output) / 1024 / 1024:.1f} MiB) "
+                 f"in {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    with Snapshot(output) as snapshot:
+        logging.info(f"Opened snapshot in {(time.perf_counter() - start) * 1000:.2f} ms")
+        if args.verify:
+            problems = verify(snapshot, args.release)
+            for problem in problems[:20]:
+                logging.error(f"Error: {problem}")
+            if problems:
+                logging.error(f"Error: {len(problems)} differences between {output} and {args.release}")
+                sys.exit(1)
+            logging.info(f"Every record and parent index in {output} matches {args.release}")
+        codes = list(snapshot.ids['vmp']) + list(snapshot.ids['amp'])
+        if not codes:
+            return
+        codes = [random.choice(codes) for _ in range(args.lookups)]
+        start = time.perf_counter()
+        for code in codes:
+            snapshot.vmp_with_amps(code)
+        elapsed = time.perf_counter() - start
+        logging.info(f"{args.lookups} VMP and AMP lookups in {elapsed:.3f}s "
+                     f"({elapsed / args.lookups * 1e6:.2f} µs per lookup)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import logging
+import os
+import sqlite3
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple, Type
+
+from dmd_parser import FLOAT_FIELDS, INT_FIELDS, Record, available_types, iter_records, release_name, table_name
+from dmd_diff import ADDED, CHANGED, KINDS, REMOVED, diff_records
+
+# Secondary indexes, created once the rows are in rather than maintained per insert
+INDEXES = {
+    'vmp': ['vtmid'],
+    'vpi': ['isid'],
+    'amp': ['vpid'],
+    'vmpp': ['vpid'],
+    'ampp': ['vppid', 'apid'],
+    'gtin': ['gtin'],
+}
+
+
+def column_type(field: str) -> str:
+    if field in INT_FIELDS:
+        return 'INTEGER'
+    if field in FLOAT_FIELDS:
+        return 'REAL'
+    return 'TEXT'
+
+
+class SQLiteLoader:
+    """Load dm+d releases into a SQLite database.
+
+    Each record type present in the release replaces its table: rows go in
+    with batched executemany calls inside one transaction, and secondary
+    indexes are only built once a table is filled. Tables are keyed on the
+    dm+d IDs (VPID, APID, VPPID, APPID, ...), which for single integer IDs
+    makes the ID the rowid itself.
+    """
+
+    BATCH_SIZE = 10000
+
+    def __init__(self, db_path: str, batch_size: int = BATCH_SIZE):
+        self.db_path = db_path
+        self.batch_size = batch_size
+
+    def connect(self) -> sqlite3.Connection:
+        # Transactions are managed explicitly so a load is all or nothing
+        conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=60)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA cache_size=-65536')
+        return conn
+
+    def create_table(self, conn: sqlite3.Connection, record_type: Type[Record]):
+        table = table_name(record_type)
+        columns = ', '.join(f'"{field}" {column_type(field)}' for field in record_type.__slots__)
+        key = ', '.join(f'"{field}"' for field in record_type.key)
+        conn.execute(f'DROP TABLE IF EXISTS "{table}"')
+        conn.execute(f'CREATE TABLE "{table}" ({columns}, PRIMARY KEY ({key}))')
+
+    def create_indexes(self, conn: sqlite3.Connection, record_type: Type[Record]):
+        table = table_name(record_type)
+        for field in INDEXES.get(table, []):
+            conn.execute(f'CREATE INDEX "{table}_{field}" ON "{table}" ("{field}")')
+
+    def insert_sql(self, record_type: Type[Record]) -> str:
+        fields = record_type.__slots__
+        columns = ', '.join(f'"{field}"' for field in fields)
+        placeholders = ', '.join('?' * len(fields))
+        return f'INSERT OR REPLACE INTO "{table_name(record_type)}" ({columns}) VALUES ({placeholders})'
+
+    def insert_records(self, conn: sqlite3.Connection, record_type: Type[Record], records) -> int:
+        """Insert records in batches, returning the number of rows."""
+        sql = self.insert_sql(record_type)
+        rows = 0
+        batch = []
+        for record in records:
+            batch.append(record.astuple())
+            if len(batch) >= self.batch_size:
+                conn.executemany(sql, batch)
+                rows += len(batch)
+                batch = []
+        if batch:
+            conn.executemany(sql, batch)
+            rows += len(batch)
+        return rows
+
+    def create_state_table(self, conn: sqlite3.Connection):
+        conn.execute('CREATE TABLE IF NOT EXISTS "dmd_tables" ("table" TEXT PRIMARY KEY, '
+                     '"release_id" TEXT, "source" TEXT, "applied_at" TEXT)')
+
+    def table_state(self, conn: sqlite3.Connection, table: str) -> Optional[Tuple[str, str]]:
+        """Return the release ID and folder a table was last loaded from, if any."""
+        return conn.execute('SELECT "release_id", "source" FROM "dmd_tables" WHERE "table" = ?',
+                            (table,)).fetchone()
+
+    def record_state(self, conn: sqlite3.Connection, table: str, release_id: str, source: str):
+        conn.execute('INSERT OR REPLACE INTO "dmd_tables" VALUES (?, ?, ?, ?)',
+                     (table, release_id, source, datetime.now(timezone.utc).isoformat()))
+
+    def apply_changes(self, conn: sqlite3.Connection, record_type: Type[Record],
+                      previous: str, source: str) -> int:
+        """Apply the differences between two releases to a table, returning the rows written."""
+        table = table_name(record_type)
+        upsert = self.insert_sql(record_type)
+        delete = f'DELETE FROM "{table}" WHERE ' + ' AND '.join(f'"{field}" = ?' for field in record_type.key)
+        counts = dict.fromkeys(KINDS, 0)
+        upserts = []
+        deletes = []
+
+        # Old records are not needed to write the new state, only the removed keys
+        for change in diff_records(previous, source, record_type, resolve_old=False):
+            counts[change.kind] += 1
+            if change.kind == REMOVED:
+                deletes.append(change.key if len(record_type.key) > 1 else (change.key,))
+            else:
+                upserts.append(change.new.astuple())
+            if len(upserts) >= self.batch_size:
+                conn.executemany(upsert, upserts)
+                upserts = []
+            if len(deletes) >= self.batch_size:
+                conn.executemany(delete, deletes)
+                deletes = []
+        if upserts:
+            conn.executemany(upsert, upserts)
+        if deletes:
+            conn.executemany(delete, deletes)
+
+        logging.info(f"Applied changes to {table}: {counts[ADDED]} added, {counts[CHANGED]} changed, "
+                     f"{counts[REMOVED]} removed")
+        return sum(counts.values())
+
+    def load(self, source: str, record_types: List[Type[Record]] = None, release_id: Optional[str] = None,
+             incremental: bool = False) -> Dict[str, int]:
+        """Load a release folder or zip, returning the rows written to each table.
+
+        The release each table was loaded from is recorded, so loading the
+        same release again leaves the table alone. With incremental set, a
+        table loaded from an earlier release whose folder or zip is still around
+        only receives the inserts, updates and deletes between the two.
+        """
+        source = os.path.abspath(source)
+        release_id = release_id or release_name(source)
+        record_types = record_types or available_types(source)
+        counts = {}
+        start = time.monotonic()
+
+        conn = self.connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            self.create_state_table(conn)
+            for record_type in record_types:
+                table = table_name(record_type)
+                table_start = time.monotonic()
+                state = self.table_state(conn, table)
+                if state is not None and state[0] == release_id:
+                    logging.info(f"{table} is already at release {release_id}. Skipping.")
+                    continue
+
+                if incremental and state is not None and os.path.exists(state[1]):
+                    counts[table] = self.apply_changes(conn, record_type, state[1], source)
+                else:
+                    self.create_table(conn, record_type)
+                    counts[table] = self.insert_records(conn, record_type, iter_records(source, record_type))
+                    self.create_indexes(conn, record_type)
+                self.record_state(conn, table, release_id, source)
+                logging.info(f"Wrote {counts[table]} rows to {table} in {time.monotonic() - table_start:.2f}s")
+            conn.execute('COMMIT')
+        except Exception:
+            # A failed BEGIN leaves nothing to roll back, and a bare ROLLBACK would mask its error
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+        elapsed = time.monotonic() - start
+        total = sum(counts.values())
+        logging.info(f"Wrote {total} rows to {self.db_path} in {elapsed:.2f}s "
+                     f"({total / elapsed if elapsed else 0:.0f} rows/s)")
+        return counts
@@ -0,0 +1,383 @@
+import io
+import os
+import sys
+import struct
+import random
+import shutil
+import logging
+import zipfile
+import tempfile
+import zlib
+from typing import Dict, List, Optional
+
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+LOCAL_HEADER_SIGNATURE = 0x04034b50
+DATA_DESCRIPTOR_SIGNATURE = 0x08074b50
+ZIP64_EXTRA_ID = 0x0001
+FEED_SIZE = 1024 * 1024  # compressed bytes inflated per step
+
+
+class StreamingZipExtractor:
+    """Extract zip members from a byte stream as their data arrives.
+
+    Members are parsed from their local headers, so extraction runs
+    alongside the download instead of after it. Anything the stream parser
+    cannot handle (encryption, compression other than deflate, stored
+    members with a data descriptor, unsafe paths) stops streaming extraction
+    and is recorded in ``failed``; the members finished so far stay in
+    ``extracted`` and the rest are left to the regular extraction of the
+    completed archive.
+
+    Members are written to a staging folder next to extract_dir and only
+    moved into place by commit(), once the whole archive has been verified;
+    discard() drops them instead.
+    """
+
+    def __init__(self, extract_dir: str, existing: Optional[Dict] = None):
+        self.extract_dir = extract_dir
+        self.staging_dir = extract_dir + '.streaming'
+        # Left behind by a download that was interrupted
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+        # (staged path, final path) of the members written so far
+        self.staged = []
+        # Members from a previous extraction manifest, left alone when unchanged
+        self.existing = existing or {}
+        self.extracted = {}
+        self.failed = None
+        self.done = False
+        self.buffer = bytearray()
+        self.member = None
+
+    def feed(self, data):
+        """Consume the next bytes of the archive."""
+        if self.failed or self.done:
+            return
+
+        self.buffer += data
+        try:
+            while not (self.failed or self.done):
+                if self.member is None:
+                    if not self.read_header():
+                        break
+                elif not self.read_data():
+                    break
+        except Exception as e:
+            self.fail(str(e))
+
+    def close(self):
+        """Stop extracting, discarding a member that was not completed."""
+        if self.member is not None:
+            self.fail("archive ended inside a member")
+        self.done = True
+
+    def commit(self):
+        """Move the members streamed so far into extract_dir."""
+        for name in self.extracted:
+            if name.endswith('/'):
+                os.makedirs(os.path.join(self.extract_dir, *filter(None, name.split('/'))), exist_ok=True)
+        for staged_path, path in self.staged:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(staged_path, path)
+        self.staged = []
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+
+    def discard(self):
+        """Drop the members streamed so far, e.g. when the archive fails its checksum."""
+        self.close()
+        self.extracted = {}
+        self.staged = []
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+
+    def fail(self, reason: str):
+        self.failed = reason
+        self.buffer = bytearray()
+        if self.member is not None and self.member['file'] is not None:
+            self.member['file'].close()
+            os.remove(self.member['tmp_path'])
+        self.member = None
+
+    def read_header(self) -> bool:
+        """Parse the next local file header; returns False until enough bytes arrived."""
+        buffer = self.buffer
+        if len(buffer) < 4:
+            return False
+        if struct.unpack_from('<I', buffer)[0] != LOCAL_HEADER_SIGNATURE:
+            # The central directory follows the last member
+            self.done = True
+            self.buffer = bytearray()
+            return False
+        if len(buffer) < LOCAL_HEADER.size:
+            return False
+
+        (_, _, flags, method, _, _, crc, compressed_size, size,
+         name_length, extra_length) = LOCAL_HEADER.unpack_from(buffer)
+        header_size = LOCAL_HEADER.size + name_length + extra_length
+        if len(buffer) < header_size:
+            return False
+
+        name = bytes(buffer[LOCAL_HEADER.size:LOCAL_HEADER.size + name_length])
+        name = name.decode('utf-8' if flags & 0x800 else 'cp437')
+        extra = bytes(buffer[LOCAL_HEADER.size + name_length:header_size])
+        del buffer[:header_size]
+
+        zip64 = self.read_zip64_extra(extra)
+        if zip64 is not None:
+            size, compressed_size = zip64
+
+        descriptor = bool(flags & 0x08)
+        if flags & 0x01:
+            raise Exception(f"{name} is encrypted")
+        if method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            raise Exception(f"{name} uses unsupported compression method {method}")
+        if descriptor and method == zipfile.ZIP_STORED:
+            raise Exception(f"{name} is stored with a data descriptor")
+
+        parts = name.split('/')
+        if name.startswith('/') or '..' in parts or '\\' in name or ':' in parts[0]:
+            raise Exception(f"{name} is not a safe member path")
+
+        path = os.path.join(self.extract_dir, *filter(None, parts))
+        member = {
+            'name': name, 'path': path, 'staged_path': os.path.join(self.staging_dir, *filter(None, parts)),
+            'method': method, 'crc': crc, 'size': size,
+            'descriptor': descriptor, 'zip64': zip64 is not None,
+            'remaining': compressed_size, 'file': None, 'tmp_path': None,
+            'actual_crc': 0, 'actual_size': 0, 'decompressor': None
+        }
+        self.member = member
+
+        if name.endswith('/'):
+            pass
+        elif not descriptor and self.is_unchanged(name, path, crc, size):
+            # Known sizes let an unchanged member be skipped without inflating it
+            pass
+        else:
+            os.makedirs(os.path.dirname(member['staged_path']), exist_ok=True)
+            member['tmp_path'] = member['staged_path']
+            member['file'] = open(member['tmp_path'], 'wb')
+
+        # Without sizes the end of the member is only found by inflating it
+        if method == zipfile.ZIP_DEFLATED and (member['file'] is not None or descriptor):
+            member['decompressor'] = zlib.decompressobj(-15)
+        return True
+
+    def read_zip64_extra(self, extra: bytes) -> Optional[tuple]:
+        """Return (size, compressed size) from a Zip64 extra field, if present."""
+        position = 0
+        while position + 4 <= len(extra):
+            field_id, field_size = struct.unpack_from('<HH', extra, position)
+            if field_id == ZIP64_EXTRA_ID and field_size >= 16:
+                return struct.unpack_from('<QQ', extra, position + 4)
+            position += 4 + field_size
+        return None
+
+    def is_unchanged(self, name: str, path: str, crc: int, size: int) -> bool:
+        member = self.existing.get(name)
+        return member is not None and member['crc'] == crc and member['size'] == size \
+            and os.path.isfile(path) and os.path.getsize(path) == size
+
+    def read_data(self) -> bool:
+        """Consume member data; returns False until more bytes are needed."""
+        member = self.member
+        buffer = self.buffer
+
+        if member['descriptor']:
+            if member['decompressor'] is not None:
+                if not buffer:
+                    return False
+                data = buffer[:FEED_SIZE]
+                self.write(member['decompressor'].decompress(data))
+                if not member['decompressor'].eof:
+                    del buffer[:len(data)]
+                    return True
+                del buffer[:len(data) - len(member['decompressor'].unused_data)]
+                member['decompressor'] = None
+            return self.read_descriptor()
+
+        if member['remaining']:
+            if not buffer:
+                return False
+            data = buffer[:min(FEED_SIZE, member['remaining'])]
+            del buffer[:len(data)]
+            member['remaining'] -= len(data)
+            if member['decompressor'] is not None:
+                self.write(member['decompressor'].decompress(data))
+            else:
+                self.write(data)
+            if member['remaining']:
+                return True
+
+        if member['decompressor'] is not None:
+            self.write(member['decompressor'].flush())
+        self.finish()
+        return True
+
+    def read_descriptor(self) -> bool:
+        """Read the data descriptor that follows a member written without sizes."""
+        buffer = self.buffer
+        size_format = '<IQQ' if self.member['zip64'] else '<III'
+        needed = struct.calcsize(size_format)
+        if len(buffer) < 4:
+            return False
+        offset = 4 if struct.unpack_from('<I', buffer)[0] == DATA_DESCRIPTOR_SIGNATURE else 0
+        if len(buffer) < offset + needed:
+            return False
+
+        crc, _, size = struct.unpack_from(size_format, buffer, offset)
+        del buffer[:offset + needed]
+        self.member['crc'] = crc
+        self.member['size'] = size
+        self.finish()
+        return True
+
+    def write(self, data):
+        member = self.member
+        if member['file'] is None:
+            return
+        member['file'].write(data)
+        member['actual_crc'] = zlib.crc32(data, member['actual_crc'])
+        member['actual_size'] += len(data)
+
+    def finish(self):
+        """Verify a completed member and stage it for commit()."""
+        member = self.member
+        if member['file'] is not None:
+            member['file'].close()
+            member['file'] = None
+            if member['actual_crc'] != member['crc'] or member['actual_size'] != member['size']:
+                os.remove(member['tmp_path'])
+                raise Exception(f"{member['name']} failed its CRC check")
+            self.staged.append((member['staged_path'], member['path']))
+
+        self.extracted[member['name']] = {'crc': member['crc'], 'size': member['size']}
+        self.member = None
+
+
+class UnseekableBuffer(io.RawIOBase):
+    """Write-only stream zipfile cannot seek back in, so it writes data descriptors."""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.data += data
+        return len(data)
+
+
+def sample_archives() -> Dict[str, bytes]:
+    """Archives covering the member layouts the parser handles, written by zipfile."""
+    rows = ''.join(f"<AMP><APID>{number}</APID><NM>Product {number % 997}</NM></AMP>\n"
+                   for number in range(5000)).encode('utf-8')
+    noise = random.Random(0).randbytes(70000)
+
+    seekable = io.BytesIO()
+    with zipfile.ZipFile(seekable, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('f_amp2_1.xml', rows)
+        archive.writestr('sub/', b'')
+        archive.writestr('sub/stored.bin', noise, compress_type=zipfile.ZIP_STORED)
+        archive.writestr('sub/empty.txt', b'')
+        with archive.open('zip64.xml', 'w', force_zip64=True) as member:
+            member.write(rows)
+
+    unseekable = UnseekableBuffer()
+    with zipfile.ZipFile(unseekable, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('descriptor.xml', rows)
+        archive.writestr('noise.bin', noise)
+        with archive.open('zip64_descriptor.xml', 'w', force_zip64=True) as member:
+            member.write(rows)
+
+    return {'sizes in headers': seekable.getvalue(), 'data descriptors': bytes(unseekable.data)}
+
+
+def read_tree(folder: str) -> Dict[str, bytes]:
+    tree = {}
+    for root, dirs, files in os.walk(folder):
+        for name in dirs:
+            tree[os.path.relpath(os.path.join(root, name), folder) + '/'] = b''
+        for name in files:
+            with open(os.path.join(root, name), 'rb') as f:
+                tree[os.path.relpath(os.path.join(root, name), folder)] = f.read()
+    return tree
+
+
+def stream(data: bytes, extract_dir: str, chunk_sizes: List[int]) -> StreamingZipExtractor:
+    extractor = StreamingZipExtractor(extract_dir)
+    position = 0
+    turn = 0
+    while position < len(data):
+        chunk_size = chunk_sizes[turn % len(chunk_sizes)]
+        extractor.feed(data[position:position + chunk_size])
+        position += chunk_size
+        turn += 1
+    extractor.close()
+    extractor.commit()
+    return extractor
+
+
+def check() -> List[str]:
+    """Stream sample archives in odd-sized chunks and compare the result with zipfile.extractall."""
+    problems = []
+    chunk_patterns = {'1 byte': [1], 'odd': [1, 7, 13, 509, 4099, 65537], 'whole': [1 << 30]}
+    for label, data in sample_archives().items():
+        with tempfile.TemporaryDirectory() as folder:
+            expected_dir = os.path.join(folder, 'expected')
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                archive.extractall(expected_dir)
+                names = [info.filename for info in archive.infolist()]
+            expected = read_tree(expected_dir)
+
+            for pattern, chunk_sizes in chunk_patterns.items():
+                streamed_dir = os.path.join(folder, pattern)
+                extractor = stream(data, streamed_dir, chunk_sizes)
+                if extractor.failed:
+                    problems.append(f"{label}, {pattern} chunks: failed with {extractor.failed}")
+                elif read_tree(streamed_dir) != expected:
+                    problems.append(f"{label}, {pattern} chunks: extracted files differ from zipfile's")
+                elif sorted(extractor.extracted) != sorted(names):
+                    problems.append(f"{label}, {pattern} chunks: recorded {sorted(extractor.extracted)}")
+
+    # What the parser refuses must stop streaming rather than write anything wrong
+    refused = UnseekableBuffer()
+    with zipfile.ZipFile(refused, 'w', zipfile.ZIP_STORED) as archive:
+        archive.writestr('stored_descriptor.bin', b'data')
+    corrupt = bytearray(sample_archives()['sizes in headers'])
+    corrupt[200] ^= 0xFF
+    unsafe = io.BytesIO()
+    with zipfile.ZipFile(unsafe, 'w') as archive:
+        archive.writestr(zipfile.ZipInfo('../outside.txt'), b'data')
+    for label, data in (('stored member with a data descriptor', bytes(refused.data)),
+                        ('corrupted member data', bytes(corrupt)),
+                        ('unsafe member path', unsafe.getvalue())):
+        with tempfile.TemporaryDirectory() as folder:
+            extractor = stream(data, os.path.join(folder, 'out'), [4099])
+            if not extractor.failed:
+                problems.append(f"{label}: streamed without failing")
+            elif os.path.exists(os.path.join(folder, 'outside.txt')):
+                problems.append(f"{label}: wrote outside the extraction folder")
+
+    # A discarded stream leaves nothing behind, e.g. after a checksum mismatch
+    with tempfile.TemporaryDirectory() as folder:
+        extract_dir = os.path.join(folder, 'out')
+        extractor = StreamingZipExtractor(extract_dir)
+        extractor.feed(sample_archives()['sizes in headers'])
+        extractor.discard()
+        if os.listdir(folder) or extractor.extracted:
+            problems.append(f"discarded stream left {os.listdir(folder)} behind")
+    return problems
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    problems = check()
+    for problem in problems:
+        logging.error(f"Error: {problem}")
+    if problems:
+        sys.exit(1)
+    logging.info("Streaming extraction matches zipfile.extractall for every sample archive")
+
+
+if __name__ == "__main__":
+    main()
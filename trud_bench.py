@@ -0,0 +1,226 @@
+import os
+import ssl
+import sys
+import time
+import random
+import shutil
+import zipfile
+import argparse
+import logging
+import tempfile
+import subprocess
+import multiprocessing
+from contextlib import contextmanager, redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterator, List, Optional
+import requests
+from trud_client import TRUDApiClient
+
+BLOCK = bytes(1024 * 1024)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answer GET /<size> with size bytes, keeping the connection open between requests."""
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; Nagle would hold the body for the delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        size = int(self.path.strip('/') or 0)
+        self.send_response(200)
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        block = memoryview(BLOCK)
+        while size:
+            count = min(size, len(block))
+            self.wfile.write(block[:count])
+            size -= count
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(ports: multiprocessing.Queue, certificate: Optional[tuple]):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    if certificate is not None:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(*certificate)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    ports.put(server.server_address[1])
+    server.serve_forever()
+
+
+def make_certificate(folder: str) -> tuple:
+    """Create a self-signed certificate for localhost, returning (cert, key) paths."""
+    cert_path = os.path.join(folder, 'stub.crt')
+    key_path = os.path.join(folder, 'stub.key')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                    '-subj', '/CN=localhost', '-addext', 'subjectAltName=DNS:localhost',
+                    '-keyout', key_path, '-out', cert_path], check=True, capture_output=True)
+    return cert_path, key_path
+
+
+@contextmanager
+def stub_server(certificate: Optional[tuple] = None) -> Iterator[str]:
+    """Run the stub in its own process, so it takes no CPU time from the client measured."""
+    ports = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(ports, certificate), daemon=True)
+    process.start()
+    try:
+        yield f"{'https' if certificate else 'http'}://localhost:{ports.get(timeout=10)}"
+    finally:
+        process.terminate()
+        process.join()
+
+
+def time_calls(call: Callable, count: int) -> List[float]:
+    timings = []
+    for _ in range(count):
+        start = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - start)
+    return sorted(timings)
+
+
+def log_latency(label: str, timings: List[float]):
+    logging.info(f"{label}: median {timings[len(timings) // 2] * 1000:.2f} ms, "
+                 f"p95 {timings[int(len(timings) * 0.95)] * 1000:.2f} ms, "
+                 f"mean {sum(timings) / len(timings) * 1000:.2f} ms")
+
+
+def bench_session(args: argparse.Namespace):
+    """Per-request latency with a new connection per request against the client's pooled session."""
+    with tempfile.TemporaryDirectory() as folder:
+        certificate = make_certificate(folder)
+        with stub_server(certificate) as base_url:
+            url = f"{base_url}/{args.size}"
+            fresh = time_calls(lambda: requests.get(url, verify=certificate[0]).content, args.requests)
+            with TRUDApiClient('bench') as client:
+                pooled = time_calls(lambda: client.session.get(url, verify=certificate[0]).content, args.requests)
+
+    logging.info(f"{args.requests} HTTPS requests of {args.size} bytes each")
+    log_latency("New connection per request", fresh)
+    log_latency("Pooled keep-alive session ", pooled)
+
+
+def legacy_download(session: requests.Session, url: str, path: str):
+    """The download loop before adaptive chunking: 1 KiB reads, with progress written and flushed per chunk."""
+    response = session.get(url, stream=True)
+    total_size = int(response.headers.get('content-length', 0))
+    downloaded = 0
+    with open(path, 'wb') as f:
+        for data in response.iter_content(1024):
+            downloaded += len(data)
+            f.write(data)
+            if total_size:
+                sys.stdout.write(f"\rProgress: {int(100 * downloaded / total_size)}%")
+                sys.stdout.flush()
+
+
+def chunked_download(client: TRUDApiClient, url: str, path: str):
+    """The client's download loop: adaptive reads into one reusable buffer, throttled progress."""
+    response = client.session.get(url, stream=True, headers=client.DOWNLOAD_HEADERS)
+    total_size = int(response.headers.get('content-length', 0))
+    downloaded = 0
+    with open(path, 'wb') as f:
+        for data in client.stream_chunks(response):
+            downloaded += len(data)
+            f.write(data)
+            client.show_progress(downloaded, total_size)
+        client.show_progress(downloaded, total_size, force=True)
+
+
+def bench_stream(args: argparse.Namespace):
+    """CPU time per GB downloaded, with the old 1 KiB loop against the client's chunked one."""
+    size = args.size * 1024 * 1024
+    with tempfile.TemporaryDirectory() as folder, stub_server() as base_url, \
+            TRUDApiClient('bench') as client, open(os.devnull, 'w') as sink:
+        url = f"{base_url}/{size}"
+        path = os.path.join(folder, 'download')
+        for label, download in (("1 KiB chunks   ", lambda: legacy_download(client.session, url, path)),
+                                ("Adaptive chunks", lambda: chunked_download(client, url, path))):
+            wall = time.perf_counter()
+            cpu = time.process_time()
+            # Progress goes to a real file, so each flush is still a write call
+            with redirect_stdout(sink):
+                download()
+            cpu = time.process_time() - cpu
+            wall = time.perf_counter() - wall
+            if os.path.getsize(path) != size:
+                raise OSError(f"downloaded {os.path.getsize(path)} of {size} bytes")
+            logging.info(f"{label}: {cpu / (size / 1e9):.2f} s CPU per GB, "
+                         f"{size / 1024 / 1024 / wall:.0f} MiB/s")
+
+
+def make_archive(path: str, members: int, member_size: int):
+    """Write a zip of XML-like members, about member_size MiB each, compressing like the real ones."""
+    rows = ''.join(f"<AMP><APID>{random.randrange(10 ** 15)}</APID><VPID>{random.randrange(10 ** 15)}</VPID>"
+                   f"<NM>Product {random.randrange(10 ** 6)} {random.randrange(1000)}mg tablets</NM></AMP>\n"
+                   for _ in range(8000))
+    block = rows.encode('utf-8')
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for number in range(members):
+            with archive.open(f"f_member{number:02}.xml", 'w') as member:
+                for _ in range(member_size * 1024 * 1024 // len(block) + 1):
+                    member.write(block)
+
+
+def bench_extract(args: argparse.Namespace):
+    """Extraction time of a synthetic multi-member archive by number of worker processes."""
+    workers = [int(count) for count in args.workers.split(',')] if args.workers else \
+        sorted({1, 2, 4, 8, 16, os.cpu_count() or 1} & set(range(1, (os.cpu_count() or 1) + 1)))
+    with tempfile.TemporaryDirectory() as folder, TRUDApiClient('bench', nested_depth=0) as client:
+        zip_path = os.path.join(folder, 'release.zip')
+        make_archive(zip_path, args.members, args.size)
+        with zipfile.ZipFile(zip_path) as archive:
+            infos = archive.infolist()
+        logging.info(f"{len(infos)} members, {sum(info.file_size for info in infos) / 1024 / 1024:.0f} MiB "
+                     f"inflated, {os.path.getsize(zip_path) / 1024 / 1024:.0f} MiB compressed, "
+                     f"{os.cpu_count()} cores")
+
+        baseline = None
+        for count in workers:
+            extract_dir = os.path.join(folder, f"extracted{count}")
+            client.extract_workers = count
+            start = time.perf_counter()
+            client.extract_members(zip_path, extract_dir, infos)
+            elapsed = time.perf_counter() - start
+            shutil.rmtree(extract_dir)
+            baseline = baseline or elapsed
+            logging.info(f"{count:2} workers: {elapsed:.2f}s ({baseline / elapsed:.2f}x)")
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the TRUD client against a local stub server.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    session = commands.add_parser('session', help="per-request latency, pooled session vs new connections")
+    session.add_argument('--requests', type=int, default=200, help="requests timed per mode (default: %(default)s)")
+    session.add_argument('--size', type=int, default=1024, help="response size in bytes (default: %(default)s)")
+    session.set_defaults(run=bench_session)
+
+    stream = commands.add_parser('stream', help="CPU time per GB, 1 KiB chunks vs adaptive chunking")
+    stream.add_argument('--size', type=int, default=1024, help="download size in MiB (default: %(default)s)")
+    stream.set_defaults(run=bench_stream)
+
+    extract = commands.add_parser('extract', help="extraction time by number of worker processes")
+    extract.add_argument('--members', type=int, default=12, help="members in the archive (default: %(default)s)")
+    extract.add_argument('--size', type=int, default=16, help="size of each member in MiB (default: %(default)s)")
+    extract.add_argument('--workers',
+                         help="comma separated worker counts to time (default: powers of two up to the core count)")
+    extract.set_defaults(run=bench_extract)
+    return parser.parse_args(argv)
+
+
+def main(argv: list = None):
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    args = parse_args(argv)
+    try:
+        args.run(args)
+    except (OSError, subprocess.CalledProcessError) as e:
+        logging.error(f"Error: {str(e)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1134 @@
+import requests
+from requests.adapters import HTTPAdapter
+import os
+import sys
+from typing import Optional, List, Dict, Tuple
+import json
+from datetime import datetime, timedelta
+import logging
+import asyncio
+import pytz 
+import zipfile
+import hashlib
+import re
+import tempfile
+import shutil
+import threading
+import multiprocessing
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, as_completed
+from streaming_zip import StreamingZipExtractor
+from content_store import ContentStore
+from dmd_sqlite import SQLiteLoader
+from dmd_arrow import ArrowExporter
+from dmd_snapshot import SnapshotWriter
+from dmd_parser import release_name
+
+def extract_file(zip_ref: zipfile.ZipFile, info: zipfile.ZipInfo, extract_dir: str):
+    """Extract one member without a content store, replacing the file at its path rather than writing into it.
+
+    The path may be a hardlink into a content store left by an earlier
+    extraction, and writing through it would change the stored object.
+    """
+    if info.is_dir():
+        zip_ref.extract(info, extract_dir)
+        return
+    os.makedirs(extract_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix='.extract-', dir=extract_dir)
+    try:
+        # zipfile sanitises the member path; the same relative path is used under extract_dir
+        extracted = zip_ref.extract(info, tmp_dir)
+        target = os.path.join(extract_dir, os.path.relpath(extracted, tmp_dir))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(extracted, target)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def is_archive(name: str) -> bool:
+    return name.lower().endswith('.zip')
+
+
+def nested_extract_dir(path: str) -> str:
+    """Return the folder a zip inside a release is extracted to: next to it, named after it."""
+    return os.path.splitext(path)[0]
+
+
+def extract_nested(extract_dir: str, name: str, depth: int,
+                   content_store: Optional[str] = None) -> Optional[Dict]:
+    """Extract an extracted member that is itself a zip, and the zips inside it down to depth levels.
+
+    Returns the manifest entries of its members, each with those of its own
+    nested zip under 'nested', or None when the member is not a zip or the
+    depth is used up.
+    """
+    if depth < 1 or not is_archive(name):
+        return None
+    path = os.path.join(extract_dir, name)
+    target = nested_extract_dir(path)
+    store = ContentStore(content_store) if content_store else None
+    members = {}
+    with zipfile.ZipFile(path, 'r') as zip_ref:
+        for info in zip_ref.infolist():
+            if store is None:
+                extract_file(zip_ref, info, target)
+            else:
+                store.extract(zip_ref, info, target)
+            member = {'crc': info.CRC, 'size': info.file_size}
+            nested = extract_nested(target, info.filename, depth - 1, content_store)
+            if nested is not None:
+                member['nested'] = nested
+            members[info.filename] = member
+    return members
+
+
+def extract_member(zip_path: str, extract_dir: str, name: str, content_store: Optional[str] = None,
+                   nested_depth: int = 0) -> Tuple[float, Optional[Dict]]:
+    """Extract one member with its own ZipFile handle, and its nested zips down to nested_depth levels.
+
+    Returns the seconds taken and the manifest entries of the nested members.
+    """
+    started = time.monotonic()
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        if content_store is None:
+            extract_file(zip_ref, zip_ref.getinfo(name), extract_dir)
+        else:
+            ContentStore(content_store).extract(zip_ref, zip_ref.getinfo(name), extract_dir)
+    nested = extract_nested(extract_dir, name, nested_depth, content_store)
+    return time.monotonic() - started, nested
+
+
+class NotModified(Exception):
+    """Raised when a conditional request finds the local copy up to date."""
+
+
+class TRUDApiClient:
+    CHECKSUM_ALGORITHMS = {32: 'md5', 40: 'sha1', 64: 'sha256', 128: 'sha512'}  # by hex length
+    CHECKSUM_RETRIES = 1
+    MIN_CHUNK_SIZE = 64 * 1024
+    MAX_CHUNK_SIZE = 8 * 1024 * 1024
+    MIN_SEGMENT_SIZE = 1024 * 1024
+    PROGRESS_INTERVAL = 0.5  # seconds between progress updates
+    # Offsets, lengths and hashes all count the bytes of the file itself, so downloads ask for no content coding
+    DOWNLOAD_HEADERS = {'Accept-Encoding': 'identity'}
+
+    def __init__(self, api_key: str, pool_connections: int = 4, pool_maxsize: int = 8,
+                 download_segments: int = 1, stream_extract: bool = False,
+                 extract_workers: int = 1, releases_ttl: int = 3600, offline: bool = False,
+                 content_store: Optional[str] = None, database: Optional[str] = None,
+                 incremental_load: bool = False, export_dir: Optional[str] = None,
+                 export_format: str = 'arrow', snapshot_dir: Optional[str] = None, nested_depth: int = 1):
+        self.api_key = api_key.lower()
+        self.base_url = "https://isd.digital.nhs.uk/trud/api/v1"
+        self.headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+            'Accept': 'application/json'
+        }
+        self.timezone = pytz.timezone('Asia/Dhaka')
+        self.download_segments = download_segments
+        self.stream_extract = stream_extract
+        self.extract_workers = extract_workers
+        # Levels of zips inside an archive (e.g. the GTIN zip) extracted along with it, 0 to leave them zipped
+        self.nested_depth = nested_depth
+        self.releases_ttl = releases_ttl
+        self.offline = offline
+        # Folder of the content-addressed member store, None to extract plain files
+        self.content_store = content_store
+        # SQLite database each release is loaded into, None to skip loading
+        self.database = database
+        # Apply only the changes since the release the database was last loaded from
+        self.incremental_load = incremental_load
+        self.database_lock = threading.Lock()
+        # Folder each release is exported to as columnar files, None to skip exporting
+        self.export_dir = export_dir
+        self.export_format = export_format
+        # Folder each release is written to as a memory-mappable snapshot, None to skip
+        self.snapshot_dir = snapshot_dir
+        self.last_progress = 0.0
+        # Downloads may run in several threads that all update the validator store
+        self.validators_lock = threading.Lock()
+        # Every segment of a download holds its own connection to the same host
+        self.session = self.create_session(pool_connections, max(pool_maxsize, download_segments))
+        self.setup_logging()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def create_session(self, pool_connections: int, pool_maxsize: int) -> requests.Session:
+        """Create a keep-alive session shared by every request the client makes."""
+        session = requests.Session()
+        # pool_connections is the number of hosts kept in the pool,
+        # pool_maxsize the number of open connections kept per host
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def close(self):
+        """Close the pooled connections."""
+        self.session.close()
+    
+    def setup_logging(self):
+        """Setup logging configuration"""
+        log_dir = 'logs'
+        os.makedirs(log_dir, exist_ok=True)
+        
+        timestamp = datetime.now(self.timezone).strftime('%Y%m%d')
+        log_file = os.path.join(log_dir, f'dmd_downloader_{timestamp}.log')
+        
+        logging.basicConfig(
+            level=logging.INFO,
+            format='%(asctime)s - Bangladesh Time - %(levelname)s - %(message)s',
+            handlers=[
+                logging.FileHandler(log_file),
+                logging.StreamHandler()
+            ]
+        )
+        
+        bd_time = datetime.now(self.timezone).strftime('%Y-%m-%d %H:%M:%S %Z')
+        logging.info(f"Script started at {bd_time}")
+
+    def get_extract_dir(self, zip_path: str) -> str:
+        """Return the folder a zip file is extracted to, named after the zip file."""
+        zip_name = os.path.splitext(os.path.basename(zip_path))[0]
+        return os.path.join('extracted', zip_name)
+
+    def extract_zip(self, zip_path: str, streamed: Optional[Dict] = None) -> bool:
+        """Extract zip file to a folder named after the zip file.
+
+        An extraction manifest next to the folder records the archive hash and
+        each member's CRC, so an unchanged archive is not extracted again and
+        a changed one only rewrites the members whose CRC differs. Members
+        already extracted while downloading are passed in as streamed.
+
+        Members that are zips themselves are extracted next to themselves,
+        down to nested_depth levels, and their members are recorded in the
+        manifest under the zip's entry.
+        """
+        try:
+            extract_dir = self.get_extract_dir(zip_path)
+            manifest_path = extract_dir + '.manifest.json'
+            
+            # Create extraction directory
+            os.makedirs(extract_dir, exist_ok=True)
+            
+            manifest = self.load_manifest(manifest_path)
+            archive = self.describe_archive(zip_path, manifest.get('archive', {}))
+            members = {**manifest.get('members', {}), **(streamed or {})}
+            
+            if members and archive['sha256'] == manifest.get('archive', {}).get('sha256') and \
+                    all(self.is_member_extracted(extract_dir, name, member) for name, member in members.items()):
+                logging.info(f"Archive {zip_path} is unchanged since the last extraction. Skipping.")
+                return True
+            
+            logging.info(f"Extracting {zip_path} to {extract_dir}")
+            
+            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+                infos = zip_ref.infolist()
+            
+            pending = [
+                info for info in infos
+                if not (self.is_member_extracted(extract_dir, info.filename, members.get(info.filename))
+                        and members[info.filename]['crc'] == info.CRC)
+            ]
+            extracted = self.extract_members(zip_path, extract_dir, pending)
+            
+            manifest = {'archive': archive, 'members': {}}
+            for info in infos:
+                member = {'crc': info.CRC, 'size': info.file_size}
+                if info.filename in extracted:
+                    nested = extracted[info.filename]
+                else:
+                    nested = members[info.filename].get('nested')
+                if nested is not None:
+                    member['nested'] = nested
+                manifest['members'][info.filename] = member
+            self.write_json_atomic(manifest_path, manifest)
+            
+            completion_time = datetime.now(self.timezone).strftime('%Y-%m-%d %H:%M:%S %Z')
+            logging.info(f"Successfully extracted {len(pending)} of {len(infos)} members from {zip_path} at {completion_time}")
+            return True
+            
+        except Exception as e:
+            logging.error(f"Error extracting {zip_path}: {str(e)}")
+            return False
+
+    def extract_members(self, zip_path: str, extract_dir: str, infos: List[zipfile.ZipInfo]) -> Dict[str, Optional[Dict]]:
+        """Extract the given members, spread over extract_workers processes.
+
+        With a content store, members are stored once by hash and hardlinked
+        into extract_dir, and a member already stored by an earlier release is
+        linked without being inflated again. A nested zip is extracted by the
+        worker that extracted it, alongside the other members; the manifest
+        entries of its members are returned by member name.
+        """
+        nested = {}
+        if self.extract_workers < 2 or len(infos) < 2:
+            store = ContentStore(self.content_store) if self.content_store else None
+            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+                for info in infos:
+                    if store is None:
+                        extract_file(zip_ref, info, extract_dir)
+                    else:
+                        store.extract(zip_ref, info, extract_dir)
+                    nested[info.filename] = extract_nested(extract_dir, info.filename, self.nested_depth,
+                                                           self.content_store)
+            return nested
+        
+        # Create parent folders up front so workers never race to create them
+        for info in infos:
+            os.makedirs(os.path.join(extract_dir, os.path.dirname(info.filename)), exist_ok=True)
+        
+        # Largest members first, so the longest inflates start straight away
+        largest_first = sorted(infos, key=lambda info: info.file_size, reverse=True)
+        # Downloads run in threads, and forking a process that has threads can deadlock it
+        start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        with ProcessPoolExecutor(max_workers=min(self.extract_workers, len(infos)),
+                                 mp_context=multiprocessing.get_context(start_method)) as executor:
+            futures = {
+                info.filename: executor.submit(extract_member, zip_path, extract_dir, info.filename,
+                                               self.content_store, self.nested_depth)
+                for info in largest_first
+            }
+            # Log in archive order whatever order the workers finish in
+            for info in infos:
+                elapsed, nested[info.filename] = futures[info.filename].result()
+                logging.info(f"Extracted {info.filename} ({info.file_size} bytes) in {elapsed:.2f}s")
+        return nested
+
+    def load_database(self, source: str, release_id: Optional[str] = None) -> bool:
+        """Load a release folder or zip into the SQLite database."""
+        try:
+            # One writer at a time; concurrent downloads queue for the database
+            with self.database_lock:
+                SQLiteLoader(self.database).load(source, release_id=release_id,
+                                                 incremental=self.incremental_load)
+            return True
+        except Exception as e:
+            logging.error(f"Error loading {source} into {self.database}: {str(e)}")
+            return False
+
+    def export_release(self, source: str) -> bool:
+        """Export a release folder or zip to columnar files."""
+        try:
+            ArrowExporter(self.export_dir, self.export_format).export(source)
+            return True
+        except Exception as e:
+            logging.error(f"Error exporting {source} to {self.export_dir}: {str(e)}")
+            return False
+
+    def write_snapshot(self, source: str) -> bool:
+        """Write a release folder or zip to a snapshot file named after the release.
+
+        Snapshots are only ever renamed into place complete, so one already
+        there for the release is kept.
+        """
+        try:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            snapshot_path = os.path.join(self.snapshot_dir, release_name(source) + '.dmdsnap')
+            if os.path.exists(snapshot_path):
+                logging.info(f"Snapshot {snapshot_path} already exists. Skipping.")
+                return True
+            counts = SnapshotWriter(snapshot_path).write(source)
+            logging.info(f"Wrote {sum(counts.values())} records to {snapshot_path}")
+            return True
+        except Exception as e:
+            logging.error(f"Error writing snapshot of {source}: {str(e)}")
+            return False
+
+    def load_manifest(self, manifest_path: str) -> Dict:
+        """Load the extraction manifest written by a previous extraction."""
+        try:
+            with open(manifest_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable extraction manifest {manifest_path}: {str(e)}")
+            return {}
+
+    def describe_archive(self, zip_path: str, previous: Dict) -> Dict:
+        """Return the size, mtime and SHA-256 of an archive.
+
+        The hash of the previous manifest, or the one computed while the
+        archive downloaded, is reused while the size and mtime are unchanged,
+        so the archive is not read again.
+        """
+        stat = os.stat(zip_path)
+        archive = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        if previous.get('size') == stat.st_size and previous.get('mtime_ns') == stat.st_mtime_ns:
+            archive['sha256'] = previous.get('sha256')
+            return archive
+        
+        # A fresh download already hashed the archive while it streamed
+        recorded = self.load_validators().get(os.path.basename(zip_path), {})
+        if recorded.get('sha256') and recorded.get('size') == stat.st_size \
+                and recorded.get('mtime_ns') == stat.st_mtime_ns:
+            archive['sha256'] = recorded['sha256']
+            return archive
+        
+        sha256 = hashlib.sha256()
+        with open(zip_path, 'rb') as f:
+            for block in iter(lambda: f.read(self.MAX_CHUNK_SIZE), b''):
+                sha256.update(block)
+        archive['sha256'] = sha256.hexdigest()
+        return archive
+
+    def is_member_extracted(self, extract_dir: str, name: str, member: Optional[Dict],
+                            depth: Optional[int] = None) -> bool:
+        """Check that a member recorded in the manifest is still on disk at its recorded size.
+
+        A zip member also needs its nested members extracted, down to depth
+        levels (nested_depth by default).
+        """
+        if member is None:
+            return False
+        path = os.path.join(extract_dir, name)
+        if name.endswith('/'):
+            return os.path.isdir(path)
+        if not (os.path.isfile(path) and os.path.getsize(path) == member['size']):
+            return False
+        depth = self.nested_depth if depth is None else depth
+        if depth < 1 or not is_archive(name):
+            return True
+        nested = member.get('nested')
+        return nested is not None and all(
+            self.is_member_extracted(nested_extract_dir(path), inner, entry, depth - 1)
+            for inner, entry in nested.items()
+        )
+
+    def load_cached_releases(self, cache_path: str) -> Dict:
+        """Load a releases listing cached by a previous run."""
+        try:
+            with open(cache_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable releases cache {cache_path}: {str(e)}")
+            return {}
+
+    def fetch_releases(self, item_id: str, latest_only: bool = False) -> Dict:
+        """Fetch the releases listing of an item through the on-disk cache.
+
+        A listing younger than releases_ttl seconds is answered from the cache
+        without a request and an older one is revalidated with a conditional
+        GET. Offline, or when the API cannot be reached, the cached listing is
+        used whatever its age.
+        """
+        cache_dir = 'cache'
+        os.makedirs(cache_dir, exist_ok=True)
+        cache_path = os.path.join(cache_dir, f"releases_{item_id}{'_latest' if latest_only else ''}.json")
+        cached = self.load_cached_releases(cache_path)
+        
+        if cached and (self.offline or time.time() - cached.get('fetched_at', 0) < self.releases_ttl):
+            logging.info(f"Using cached releases for item {item_id}")
+            return cached['data']
+        if self.offline:
+            raise Exception(f"No cached releases for item {item_id} to use offline")
+        
+        url = f"{self.base_url}/keys/{self.api_key}/items/{item_id}/releases"
+        if latest_only:
+            url += "?latest"
+        
+        headers = {}
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+        
+        try:
+            logging.info(f"Fetching releases from API")
+            response = self.session.get(url, headers=headers)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            if not cached:
+                raise
+            logging.warning(f"Releases API unavailable ({str(e)}), using cached releases for item {item_id}")
+            return cached['data']
+        
+        if response.status_code == 304:
+            data = cached['data']
+        else:
+            data = response.json()
+            if data.get('message') != 'OK':
+                raise Exception(f"API Error: {data.get('message', 'Unknown error')}")
+        
+        self.write_json_atomic(cache_path, {
+            'fetched_at': time.time(),
+            'etag': response.headers.get('etag', cached.get('etag')),
+            'last_modified': response.headers.get('last-modified', cached.get('last_modified')),
+            'data': data
+        })
+        return data
+
+    def get_releases(self, item_id: str, latest_only: bool = True,
+                     since: Optional[timedelta] = None) -> List[Dict]:
+        """Get releases for an item, optionally only those released within since."""
+        try:
+            data = self.fetch_releases(item_id, latest_only)
+            if since is None:
+                return data.get('releases', [])
+            
+            # Filter releases from the window
+            window_start = datetime.now() - since
+            filtered_releases = []
+            
+            for release in data.get('releases', []):
+                release_date = datetime.strptime(release['releaseDate'], '%Y-%m-%d')
+                if release_date >= window_start:
+                    filtered_releases.append(release)
+            
+            logging.info(f"Found {len(filtered_releases)} releases of item {item_id} in the last {since.days} days")
+            return filtered_releases
+        
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Error fetching releases: {str(e)}")
+            if hasattr(e, 'response'):
+                logging.error(f"Response status: {e.response.status_code}")
+                logging.error(f"Response body: {e.response.text}")
+            return []
+
+    def load_validators(self) -> Dict:
+        """Load the validators recorded for previously downloaded files."""
+        try:
+            with open(os.path.join('downloads', '.validators.json')) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable validator store: {str(e)}")
+            return {}
+
+    def save_validators(self, filename: str, response: requests.Response, sha256: str):
+        """Record the validators a completed download was served with, and its hash."""
+        stat = os.stat(os.path.join('downloads', filename))
+        with self.validators_lock:
+            validators = self.load_validators()
+            validators[filename] = {
+                'etag': response.headers.get('etag'),
+                'last_modified': response.headers.get('last-modified'),
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'sha256': sha256
+            }
+            self.write_json_atomic(os.path.join('downloads', '.validators.json'), validators)
+
+    def conditional_headers(self, filename: str) -> Dict:
+        """Build If-None-Match/If-Modified-Since headers for a file already on disk."""
+        filepath = os.path.join('downloads', filename)
+        validators = self.load_validators().get(filename)
+        if not validators or not os.path.exists(filepath) \
+                or os.path.getsize(filepath) != validators.get('size'):
+            return {}
+        
+        headers = {}
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+        return headers
+
+    def read_resume_state(self, part_path: str) -> Dict:
+        """Read the validator and progress recorded for a partial download."""
+        state_path = part_path + '.json'
+        if not (os.path.exists(part_path) and os.path.exists(state_path)):
+            return {}
+        
+        try:
+            with open(state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable resume state {state_path}: {str(e)}")
+            return {}
+        
+        if 'offset' in state:
+            # Never resume past what actually reached the disk
+            state['offset'] = min(int(state['offset']), os.path.getsize(part_path))
+        return state
+
+    def write_resume_state(self, part_path: str, validator: Optional[str], **progress):
+        """Record the validator and progress (offset or segments) of a partial download."""
+        self.write_json_atomic(part_path + '.json', {'validator': validator, **progress})
+
+    def write_json_atomic(self, path: str, data: Dict):
+        """Write JSON through a synced temp file and os.replace, so readers never see a partial file."""
+        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(path) or '.',
+                                         suffix='.tmp', delete=False) as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f.name, path)
+
+    def fsync_path(self, path: str):
+        """Flush a file, or a directory after a rename in it, to stable storage."""
+        if os.path.isdir(path):
+            if not hasattr(os, 'O_DIRECTORY'):
+                return  # directories cannot be synced on Windows
+            fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+        else:
+            fd = os.open(path, os.O_RDWR)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def get_validator(self, response: requests.Response) -> Optional[str]:
+        """Return a strong validator usable in an If-Range header."""
+        etag = response.headers.get('etag')
+        if etag and not etag.startswith('W/'):
+            return etag
+        return response.headers.get('last-modified')
+
+    def download_file(self, url: str, filename: str, segments: Optional[int] = None,
+                      extractor: Optional[StreamingZipExtractor] = None,
+                      expected: Optional[Tuple[str, str]] = None, size: Optional[int] = None) -> bool:
+        """Download a file with progress indicator, resuming a previous partial download.
+
+        A file already on disk is revalidated with a conditional GET and
+        kept when the server answers 304 Not Modified. With more than one
+        segment the file is fetched as concurrent byte ranges, falling back
+        to a single stream when the server does not support ranges; a file
+        whose size (as listed with the release) is too small to split goes
+        straight to a single stream, without the range probe. An
+        extractor, if given, is fed the bytes of a single-stream download as
+        they arrive. The bytes are hashed as they are written; an expected
+        (algorithm, digest) pair is checked and the download retried on a
+        mismatch. What the extractor streamed out is committed only once the
+        download is verified, and discarded otherwise.
+        """
+        try:
+            downloads_dir = 'downloads'
+            os.makedirs(downloads_dir, exist_ok=True)
+            filepath = os.path.join(downloads_dir, filename)
+            part_path = filepath + '.part'
+            
+            for attempt in range(self.CHECKSUM_RETRIES + 1):
+                hashes = {'sha256': hashlib.sha256()}
+                if expected is not None:
+                    hashes.setdefault(expected[0], hashlib.new(expected[0]))
+                
+                state = self.read_resume_state(part_path)
+                # A partial download supersedes whatever is on disk, so only revalidate without one
+                conditional = {} if state else self.conditional_headers(filename)
+                segments = segments or self.download_segments
+                
+                # A single-stream partial download is cheaper to finish than to restart in segments
+                response = None
+                small = size is not None and int(size) < 2 * self.MIN_SEGMENT_SIZE
+                if segments > 1 and 'offset' not in state and not small:
+                    response = self.download_segmented(url, filepath, segments, state, conditional, hashes)
+                if response is None:
+                    response = self.download_stream(url, filepath, state, conditional, hashes, extractor)
+                
+                if expected is None or hashes[expected[0]].hexdigest() == expected[1].lower():
+                    break
+                
+                # A corrupt part file must not be resumed from, nor anything streamed out of it kept
+                os.remove(part_path)
+                os.remove(part_path + '.json')
+                if extractor is not None:
+                    extractor.discard()
+                    extractor = None
+                if attempt == self.CHECKSUM_RETRIES:
+                    raise Exception(f"{expected[0]} checksum mismatch for {filename}")
+                logging.warning(f"{expected[0]} checksum mismatch for {filename}, downloading again")
+            
+            # Members streamed out of the archive only go live once it is verified
+            if extractor is not None:
+                extractor.commit()
+            # Only complete, synced data ever appears under the final name
+            self.fsync_path(part_path)
+            os.replace(part_path, filepath)
+            self.fsync_path(downloads_dir)
+            os.remove(part_path + '.json')
+            self.save_validators(filename, response, hashes['sha256'].hexdigest())
+            
+            completion_time = datetime.now(self.timezone).strftime('%Y-%m-%d %H:%M:%S %Z')
+            logging.info(f"Successfully downloaded {filepath} at {completion_time}")
+            return True
+            
+        except NotModified:
+            logging.info(f"File {filename} is already up to date. Skipping download.")
+            if extractor is not None:
+                extractor.discard()
+            return True
+            
+        except Exception as e:
+            logging.error(f"Error downloading {filename}: {str(e)}")
+            if extractor is not None:
+                extractor.discard()
+            return False
+
+    def download_stream(self, url: str, filepath: str, state: Dict, conditional: Dict, hashes: Dict,
+                        extractor: Optional[StreamingZipExtractor] = None) -> requests.Response:
+        """Download url into filepath's part file as a single stream, appending to a previous partial download.
+
+        Every byte of the file is fed to hashes, the already downloaded prefix
+        of a resumed download included.
+        """
+        filename = os.path.basename(filepath)
+        part_path = filepath + '.part'
+        offset = state.get('offset', 0)
+        headers = {**self.DOWNLOAD_HEADERS, **conditional}
+        if offset and state.get('validator'):
+            # If-Range makes the server send the whole file if it changed meanwhile
+            headers['Range'] = f"bytes={offset}-"
+            headers['If-Range'] = state['validator']
+            logging.info(f"Resuming download: {filename} from byte {offset}")
+        else:
+            offset = 0
+            logging.info(f"Starting download: {filename}")
+        
+        response = self.session.get(url, stream=True, headers=headers)
+        response.raise_for_status()
+        if response.status_code == 304:
+            response.close()
+            raise NotModified()
+        
+        # A server that encodes the body anyway sends lengths and ranges of the encoded bytes
+        encoded = self.is_encoded(response)
+        content_range = response.headers.get('content-range', '')
+        if offset and (encoded or not (response.status_code == 206 and content_range.startswith(f"bytes {offset}-"))):
+            logging.info(f"Server sent the full file for {filename}, restarting download")
+            offset = 0
+        
+        if offset and extractor is not None:
+            logging.info(f"Resumed download of {filename} will be extracted once complete")
+            extractor = None
+        if offset:
+            self.hash_part(part_path, 0, offset, hashes)
+        
+        validator = self.get_validator(response)
+        content_length = 0 if encoded else int(response.headers.get('content-length', 0))
+        total_size = offset + content_length if content_length else 0
+        checkpoint_size = 8 * 1024 * 1024  # bytes between resume state updates
+        downloaded = offset
+        checkpoint = offset
+        
+        with open(part_path, 'ab') as f:
+            f.truncate(offset)
+            self.write_resume_state(part_path, validator, offset=offset)
+            try:
+                for data in self.stream_chunks(response):
+                    downloaded += len(data)
+                    f.write(data)
+                    for hasher in hashes.values():
+                        hasher.update(data)
+                    if extractor is not None:
+                        extractor.feed(data)
+                    if downloaded - checkpoint >= checkpoint_size:
+                        f.flush()
+                        self.write_resume_state(part_path, validator, offset=downloaded)
+                        checkpoint = downloaded
+                    self.show_progress(downloaded, total_size)
+            finally:
+                f.flush()
+                self.write_resume_state(part_path, validator, offset=downloaded)
+                self.show_progress(downloaded, total_size, force=True)
+                if extractor is not None:
+                    extractor.close()
+        
+        if total_size and downloaded != total_size:
+            raise Exception(f"Incomplete download: got {downloaded} of {total_size} bytes")
+        return response
+
+    def is_encoded(self, response: requests.Response) -> bool:
+        """Check whether a response body is content-encoded despite DOWNLOAD_HEADERS."""
+        return response.headers.get('content-encoding', 'identity').lower() != 'identity'
+
+    def stream_chunks(self, response: requests.Response):
+        """Yield the response body as views into one reusable buffer.
+
+        The read size starts at MIN_CHUNK_SIZE and doubles while reads fill
+        it quickly, up to MAX_CHUNK_SIZE; it halves again when reads stall.
+        Each view is only valid until the next one is requested.
+        """
+        response.raw.decode_content = True
+        buffer = memoryview(bytearray(self.MAX_CHUNK_SIZE))
+        chunk_size = self.MIN_CHUNK_SIZE
+        target_time = 0.1  # seconds a single read should take
+        
+        while True:
+            started = time.monotonic()
+            count = response.raw.readinto(buffer[:chunk_size])
+            if not count:
+                break
+            elapsed = time.monotonic() - started
+            yield buffer[:count]
+            
+            if count == chunk_size and elapsed < target_time and chunk_size < self.MAX_CHUNK_SIZE:
+                chunk_size *= 2
+            elif elapsed > 4 * target_time and chunk_size > self.MIN_CHUNK_SIZE:
+                chunk_size //= 2
+
+    def show_progress(self, downloaded: int, total_size: int, force: bool = False):
+        """Render download progress, at most once every PROGRESS_INTERVAL seconds."""
+        now = time.monotonic()
+        if not total_size or (not force and now - self.last_progress < self.PROGRESS_INTERVAL):
+            return
+        
+        self.last_progress = now
+        sys.stdout.write(f"\rProgress: {int(100 * downloaded / total_size)}%")
+        sys.stdout.flush()
+
+    def download_segmented(self, url: str, filepath: str, segments: int, state: Dict,
+                           conditional: Dict, hashes: Dict) -> Optional[requests.Response]:
+        """Download url into filepath's part file as concurrent byte ranges.
+
+        Returns the response of the initial probe, or None without touching
+        the part file when the server does not support range requests, so the
+        caller can fall back to a single stream. hashes follow the contiguous
+        prefix of finished bytes while the segments download, reading it back
+        while it is still in the page cache.
+        """
+        filename = os.path.basename(filepath)
+        part_path = filepath + '.part'
+        probe = self.session.get(url, stream=True, headers={**self.DOWNLOAD_HEADERS, 'Range': 'bytes=0-0', **conditional})
+        probe.close()
+        if probe.status_code == 304:
+            raise NotModified()
+        
+        content_range = probe.headers.get('content-range', '')
+        if probe.status_code != 206 or probe.headers.get('accept-ranges') == 'none' or self.is_encoded(probe) \
+                or not content_range.startswith('bytes 0-0/') or content_range.endswith('/*'):
+            logging.info(f"Server does not support range requests for {filename}, using a single stream")
+            return None
+        
+        validator = self.get_validator(probe)
+        total_size = int(content_range.rsplit('/', 1)[1])
+        segments = min(segments, total_size // self.MIN_SEGMENT_SIZE)
+        if segments < 2:
+            return None
+        
+        if state.get('validator') == validator and state.get('size') == total_size \
+                and os.path.getsize(part_path) == total_size:
+            ranges = state['segments']
+            logging.info(f"Resuming segmented download: {filename}")
+        else:
+            step = -(-total_size // segments)
+            ranges = [[start, min(start + step, total_size) - 1, start]
+                      for start in range(0, total_size, step)]
+            with open(part_path, 'wb') as f:
+                f.truncate(total_size)
+            logging.info(f"Starting segmented download: {filename} in {len(ranges)} segments")
+        
+        stop = threading.Event()
+        hashed = 0
+        with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            futures = [executor.submit(self.download_segment, url, part_path, segment, validator, stop)
+                       for segment in ranges]
+            try:
+                pending = futures
+                while pending:
+                    done, pending = wait(pending, timeout=0.5)
+                    if any(future.exception() for future in done):
+                        stop.set()
+                    downloaded = sum(position - start for start, end, position in ranges)
+                    hashed = self.hash_part(part_path, hashed, self.contiguous_end(ranges), hashes)
+                    self.write_resume_state(part_path, validator, size=total_size, segments=ranges)
+                    self.show_progress(downloaded, total_size, force=True)
+            finally:
+                stop.set()
+                self.write_resume_state(part_path, validator, size=total_size, segments=ranges)
+        
+        for future in futures:
+            future.result()
+        self.hash_part(part_path, hashed, total_size, hashes)
+        return probe
+
+    def contiguous_end(self, ranges: List[List[int]]) -> int:
+        """Return the end of the unbroken run of downloaded bytes from the start of the file."""
+        for start, end, position in ranges:
+            if position <= end:
+                return position
+        return ranges[-1][1] + 1
+
+    def hash_part(self, part_path: str, start: int, end: int, hashes: Dict) -> int:
+        """Feed bytes start..end of a part file to hashes, returning end."""
+        if end <= start:
+            return start
+        with open(part_path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start
+            while remaining:
+                block = f.read(min(remaining, self.MAX_CHUNK_SIZE))
+                if not block:
+                    raise Exception(f"{part_path} is shorter than expected")
+                for hasher in hashes.values():
+                    hasher.update(block)
+                remaining -= len(block)
+        return end
+
+    def download_segment(self, url: str, part_path: str, segment: List[int],
+                         validator: Optional[str], stop: threading.Event):
+        """Fetch one byte range of a segmented download, writing it in place."""
+        start, end, position = segment
+        if position > end:
+            return
+        
+        headers = {**self.DOWNLOAD_HEADERS, 'Range': f"bytes={position}-{end}"}
+        if validator:
+            headers['If-Range'] = validator
+        
+        with self.session.get(url, stream=True, headers=headers) as response:
+            response.raise_for_status()
+            if response.status_code != 206 or self.is_encoded(response):
+                raise Exception(f"Server stopped honouring range requests at byte {position}")
+            
+            # Unbuffered, so the recorded position never runs ahead of the file
+            with open(part_path, 'r+b', buffering=0) as f:
+                f.seek(position)
+                for data in self.stream_chunks(response):
+                    if stop.is_set():
+                        return
+                    f.write(data)
+                    segment[2] += len(data)
+        
+        if segment[2] != end + 1:
+            raise Exception(f"Incomplete segment: got bytes {start}-{segment[2] - 1} of {start}-{end}")
+
+    def parse_checksum_file(self, checksum_path: str) -> Optional[Tuple[str, str]]:
+        """Return the (algorithm, hex digest) declared by a checksum file.
+
+        The algorithm is taken from its name in the file or file name (md5,
+        sha1, sha256, sha512) and otherwise inferred from the digest length.
+        """
+        with open(checksum_path, 'r', errors='replace') as f:
+            text = f.read()
+        
+        digests = [digest for digest in re.findall(r'\b[0-9a-fA-F]{32,128}\b', text)
+                   if len(digest) in self.CHECKSUM_ALGORITHMS]
+        named = re.search(r'sha-?(512|256|1)\b|md5', f"{os.path.basename(checksum_path)} {text}", re.IGNORECASE)
+        if named:
+            algorithm = 'md5' if named.group(1) is None else f"sha{named.group(1)}"
+            for digest in digests:
+                if self.CHECKSUM_ALGORITHMS[len(digest)] == algorithm:
+                    return algorithm, digest
+        
+        if digests:
+            return self.CHECKSUM_ALGORITHMS[len(digests[0])], digests[0]
+        logging.warning(f"No checksum found in {checksum_path}")
+        return None
+
+    def process_archive(self, release: Dict, extract_after_download: bool = True,
+                        extractor: Optional[StreamingZipExtractor] = None) -> bool:
+        """Run the stages after a release archive is downloaded: extraction, database, export and snapshot.
+
+        Without extraction the release files are read straight from the zip.
+        An extractor that ran during the download hands over the members it
+        already extracted.
+        """
+        zip_path = os.path.join('downloads', release['archiveFileName'])
+        success = True
+        source = zip_path
+        if extract_after_download:
+            streamed = None
+            if extractor is not None:
+                streamed = extractor.extracted
+                if extractor.failed:
+                    logging.warning(f"Streaming extraction stopped: {extractor.failed}")
+            extracted = self.extract_zip(zip_path, streamed)
+            success &= extracted
+            source = self.get_extract_dir(zip_path) if extracted else None
+        if source and self.database:
+            success &= self.load_database(source, release.get('releaseId'))
+        if source and self.export_dir:
+            success &= self.export_release(source)
+        if source and self.snapshot_dir:
+            success &= self.write_snapshot(source)
+        return success
+
+    def download_release(self, release: Dict, 
+                        include_checksum: bool = False,
+                        include_signature: bool = False,
+                        extract_after_download: bool = True) -> bool:
+        """Download a specific release and its associated files.
+
+        The checksum file is fetched first, so the archive can be verified
+        while it downloads.
+        """
+        success = True
+        expected = None
+        
+        if include_checksum and 'checksumFileUrl' in release:
+            checksum_success = self.download_file(
+                release['checksumFileUrl'],
+                release['checksumFileName'],
+                size=release.get('checksumFileSizeBytes')
+            )
+            success &= checksum_success
+            if checksum_success:
+                expected = self.parse_checksum_file(os.path.join('downloads', release['checksumFileName']))
+        
+        if 'archiveFileUrl' in release:
+            zip_path = os.path.join('downloads', release['archiveFileName'])
+            extractor = None
+            if extract_after_download and self.stream_extract:
+                # Extract members while the archive is still downloading
+                extract_dir = self.get_extract_dir(zip_path)
+                manifest = self.load_manifest(extract_dir + '.manifest.json')
+                extractor = StreamingZipExtractor(extract_dir, manifest.get('members'))
+            
+            file_success = self.download_file(
+                release['archiveFileUrl'],
+                release['archiveFileName'],
+                extractor=extractor,
+                expected=expected,
+                size=release.get('archiveFileSizeBytes')
+            )
+            success &= file_success
+            if file_success:
+                success &= self.process_archive(release, extract_after_download, extractor)
+        
+        if include_signature and 'signatureFileUrl' in release:
+            success &= self.download_file(
+                release['signatureFileUrl'],
+                release['signatureFileName'],
+                size=release.get('signatureFileSizeBytes')
+            )
+        
+        return success
+
+
+class AsyncTRUDApiClient:
+    """asyncio front end to TRUDApiClient for refreshing several items at once.
+
+    Calls run the blocking client in worker threads that share its
+    connection pool, and a semaphore bounds how many releases download at
+    the same time.
+    """
+
+    def __init__(self, api_key: str, concurrency: int = 4, **client_options):
+        download_segments = client_options.get('download_segments', 1)
+        client_options['pool_maxsize'] = max(client_options.get('pool_maxsize', 8),
+                                             concurrency * download_segments)
+        self.client = TRUDApiClient(api_key, **client_options)
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close the pooled connections."""
+        self.client.close()
+
+    async def get_releases(self, item_id: str, latest_only: bool = True,
+                           since: Optional[timedelta] = None) -> List[Dict]:
+        """Get releases for an item, optionally only those released within since."""
+        return await asyncio.to_thread(self.client.get_releases, item_id, latest_only, since)
+
+    async def get_releases_for_items(self, item_ids: List[str], latest_only: bool = True,
+                                     since: Optional[timedelta] = None) -> Dict[str, List[Dict]]:
+        """Get the releases of several items concurrently."""
+        releases = await asyncio.gather(*(self.get_releases(item_id, latest_only, since)
+                                          for item_id in item_ids))
+        return dict(zip(item_ids, releases))
+
+    async def download_release(self, release: Dict, **options) -> bool:
+        """Download a specific release once a download slot is free."""
+        async with self.semaphore:
+            return await asyncio.to_thread(self.client.download_release, release, **options)
+
+    async def download_releases(self, releases: List[Dict], **options) -> List[bool]:
+        """Download several releases with bounded concurrency."""
+        return await asyncio.gather(*(self.download_release(release, **options) for release in releases))
+
+    async def refresh_item(self, item_id: str, latest_only: bool = True, **options) -> bool:
+        """Fetch the releases of one item and download them."""
+        logging.info(f"Fetching releases (item ID: {item_id})...")
+        releases = await self.get_releases(item_id, latest_only)
+        if not releases:
+            logging.warning(f"No releases found for item {item_id}")
+            return False
+        
+        for release in releases:
+            logging.info("\nRelease Information:")
+            logging.info(f"Item ID: {item_id}")
+            logging.info(f"Release ID: {release.get('releaseId', 'N/A')}")
+            logging.info(f"Release Date: {release.get('releaseDate', 'N/A')}")
+            logging.info(f"File Name: {release.get('archiveFileName', 'N/A')}")
+        
+        return all(await self.download_releases(releases, **options))
+
+    async def refresh_items(self, item_ids: List[str], latest_only: bool = True, **options) -> bool:
+        """Refresh several items concurrently; each item starts downloading as soon as its releases arrive."""
+        results = await asyncio.gather(*(self.refresh_item(item_id, latest_only, **options)
+                                         for item_id in item_ids))
+        return all(results)
+
+
+class BackfillScheduler:
+    """Catch up on a window of releases with a bounded pool of download workers.
+
+    The plan lists every archive and checksum file missing from downloads/;
+    releases with missing files are downloaded largest first so the long
+    transfers overlap the short ones, and complete releases only go through
+    the stages after the download (manifest-checked extraction, export,
+    snapshot), which skip work already done.
+    """
+
+    def __init__(self, client: TRUDApiClient, concurrency: int = 4):
+        self.client = client
+        self.concurrency = concurrency
+
+    def plan(self, releases: List[Dict], include_checksum: bool = True) -> List[Dict]:
+        """List the missing files of each release, largest release first."""
+        plan = []
+        for release in releases:
+            files = []
+            if 'archiveFileUrl' in release:
+                files.append((release['archiveFileName'], release.get('archiveFileSizeBytes', 0)))
+            if include_checksum and 'checksumFileUrl' in release:
+                files.append((release['checksumFileName'], release.get('checksumFileSizeBytes', 0)))
+            
+            missing = [(name, size) for name, size in files
+                       if not os.path.exists(os.path.join('downloads', name))]
+            plan.append({
+                'release': release,
+                'missing': [name for name, size in missing],
+                'size': sum(int(size) for name, size in missing)
+            })
+        
+        plan.sort(key=lambda entry: entry['size'], reverse=True)
+        missing_count = sum(len(entry['missing']) for entry in plan)
+        total_size = sum(entry['size'] for entry in plan)
+        logging.info(f"Backfill plan: {missing_count} missing files ({total_size / 1024 / 1024:.1f} MiB) "
+                     f"across {len(plan)} releases")
+        return plan
+
+    def run(self, plan: List[Dict], **options) -> bool:
+        """Execute a plan, logging failed releases and the aggregate throughput."""
+        started = time.monotonic()
+        success = True
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = {executor.submit(self.run_entry, entry, **options): entry for entry in plan}
+            for future in as_completed(futures):
+                release = futures[future]['release']
+                if not future.result():
+                    logging.error(f"Failed to download or extract files for release date {release.get('releaseDate', 'N/A')}")
+                    success = False
+        
+        elapsed = time.monotonic() - started
+        downloaded = sum(os.path.getsize(os.path.join('downloads', name))
+                         for entry in plan for name in entry['missing']
+                         if os.path.exists(os.path.join('downloads', name)))
+        logging.info(f"Backfill downloaded {downloaded / 1024 / 1024:.1f} MiB in {elapsed:.1f}s "
+                     f"({downloaded / 1024 / 1024 / max(elapsed, 0.001):.1f} MiB/s)")
+        return success
+
+    def run_entry(self, entry: Dict, **options) -> bool:
+        release = entry['release']
+        if entry['missing']:
+            return self.client.download_release(release, **options)
+        
+        # Everything is on disk already; downloads are only ever published complete
+        if 'archiveFileName' in release:
+            return self.client.process_archive(release, options.get('extract_after_download', True))
+        return True